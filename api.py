@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+import json
+import struct
+from typing import Dict, List
+
+from timetable_svg import ScheduleRow
+
+# Binary layout (little-endian), for clients too small to parse JSON:
+#   magic "MTAW", u8 format version, u32 generated-at epoch,
+#   u16 string count, then per string: u8 length + UTF-8 bytes (at most 255,
+#   cut on a character boundary),
+#   u16 row count, then per row: u16 route string index, u16 stop string index,
+#   u8 direction (0 = Uptown, 1 = Downtown), u8 time count, u32 epoch per time.
+# Format 1 used u8 string counts and indexes, which capped a view at 255
+# distinct routes and stop names.
+BINARY_MAGIC = b"MTAW"
+BINARY_FORMAT = 2
+MAX_STRING_BYTES = 255
+DIRECTION_CODES = {"Uptown": 0, "Downtown": 1}
+
+
+def encode_json(rows: List[ScheduleRow], now: dt.datetime) -> bytes:
+    data = {
+        "now": int(now.timestamp()),
+        "rows": [
+            {"r": row.route, "s": row.stop_name, "d": row.direction, "t": list(row.times)}
+            for row in rows
+        ],
+    }
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _truncate_utf8(text: str, limit: int) -> bytes:
+    raw = text.encode("utf-8")
+    if len(raw) <= limit:
+        return raw
+    # Drop a multi-byte character split by the cut rather than emit half of it.
+    return raw[:limit].decode("utf-8", "ignore").encode("utf-8")
+
+
+def encode_binary(rows: List[ScheduleRow], now: dt.datetime) -> bytes:
+    strings: Dict[str, int] = {}
+
+    def intern(text: str) -> int:
+        if text not in strings:
+            strings[text] = len(strings)
+        return strings[text]
+
+    body = bytearray(struct.pack("<H", len(rows)))
+    for row in rows:
+        times = row.times[:255]
+        body += struct.pack(
+            "<HHBB",
+            intern(row.route),
+            intern(row.stop_name),
+            DIRECTION_CODES.get(row.direction, 1),
+            len(times),
+        )
+        body += struct.pack(f"<{len(times)}I", *times)
+
+    out = bytearray(BINARY_MAGIC)
+    out += struct.pack("<BIH", BINARY_FORMAT, int(now.timestamp()), len(strings))
+    for text in strings:
+        raw = _truncate_utf8(text, MAX_STRING_BYTES)
+        out += struct.pack("<B", len(raw)) + raw
+    out += body
+    return bytes(out)
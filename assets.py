@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate
+from typing import Dict, Tuple
+
+from render_cache import Rendered, encode_payload
+
+ASSET_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Already-compressed formats aren't worth gzipping again.
+_NO_COMPRESS = ("image/png", "image/jpeg", "image/gif", "image/webp")
+
+
+@dataclass(frozen=True)
+class Asset:
+    rendered: Rendered
+    content_type: str
+    cache_control: str
+    mtime: float
+
+    @property
+    def last_modified(self) -> str:
+        return formatdate(self.mtime, usegmt=True)
+
+
+class AssetStore:
+    """Static files held in memory with their ETag and compressed variants.
+
+    Files resolve relative to the project directory rather than the working
+    directory, and are re-read only when their mtime changes (checked at most
+    every ``check_interval`` seconds).
+    """
+
+    def __init__(self, root: str = ASSET_DIR, check_interval: float = 2.0) -> None:
+        self.root = root
+        self.check_interval = check_interval
+        self._routes: Dict[str, Tuple[str, str, str]] = {}
+        self._assets: Dict[str, Asset | None] = {}
+        self._checked: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        url_path: str,
+        filename: str,
+        content_type: str,
+        cache_control: str = "public, max-age=86400",
+    ) -> None:
+        self._routes[url_path] = (filename, content_type, cache_control)
+        self._assets[url_path] = self._load(url_path)
+        self._checked[url_path] = time.monotonic()
+
+    def __contains__(self, url_path: str) -> bool:
+        return url_path in self._routes
+
+    def get(self, url_path: str) -> Asset | None:
+        if url_path not in self._routes:
+            return None
+        now = time.monotonic()
+        if now - self._checked.get(url_path, 0.0) >= self.check_interval:
+            with self._lock:
+                self._checked[url_path] = now
+                current = self._assets.get(url_path)
+                mtime = self._mtime(url_path)
+                if current is None or mtime is None or mtime != current.mtime:
+                    self._assets[url_path] = self._load(url_path)
+        return self._assets.get(url_path)
+
+    def _path(self, url_path: str) -> str:
+        return os.path.join(self.root, self._routes[url_path][0])
+
+    def _mtime(self, url_path: str) -> float | None:
+        try:
+            return os.stat(self._path(url_path)).st_mtime
+        except OSError:
+            return None
+
+    def _load(self, url_path: str) -> Asset | None:
+        _, content_type, cache_control = self._routes[url_path]
+        path = self._path(url_path)
+        try:
+            with open(path, "rb") as handle:
+                mtime = os.fstat(handle.fileno()).st_mtime
+                data = handle.read()
+        except OSError:
+            return None
+        compress = not content_type.startswith(_NO_COMPRESS)
+        return Asset(encode_payload(data, compress=compress), content_type, cache_control, mtime)
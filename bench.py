@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime as dt
+import json
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+from extract import StopIndex, extract_arrivals
+from feed_sim import synthetic_feed
+from feeds import parse_feed
+from schedule_index import ScheduleIndex, schedule_rows
+from timetable_svg import ET_TZ, build_schedule, iter_arrivals, render_svg
+
+# Roughly the size of the live numbered-lines feed (~500 trips, ~1 MB).
+FEED_SIZES = {
+    "gtfs": (600, 35),
+    "gtfs-ace": (350, 30),
+    "gtfs-nqrw": (300, 30),
+    "gtfs-bdfm": (350, 30),
+}
+STATION_COUNTS = (3, 25, 100, 400)
+# Median slowdown (new / base) that --compare reports as a regression.
+REGRESSION_RATIO = 1.2
+
+
+def station_map(count: int) -> Dict[str, str]:
+    # synthetic_feed() draws its non-watched stop ids from "100".."999".
+    return {str(100 + i): f"Station {i}" for i in range(count)}
+
+
+def measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    fn()  # warm caches (lru_cache, interned strings) like a running server
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter_ns()
+        fn()
+        samples.append((time.perf_counter_ns() - start) / 1e6)
+    samples.sort()
+
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    snap_before = tracemalloc.take_snapshot()
+    result = fn()
+    after, peak = tracemalloc.get_traced_memory()
+    snap_after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    del result
+    blocks = sum(stat.count_diff for stat in snap_after.compare_to(snap_before, "filename") if stat.count_diff > 0)
+
+    return {
+        "min_ms": round(samples[0], 4),
+        "median_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        "mean_ms": round(statistics.fmean(samples), 4),
+        "peak_kb": round((peak - before) / 1024, 1),
+        "retained_kb": round((after - before) / 1024, 1),
+        "retained_blocks": blocks,
+    }
+
+
+def run(repeat: int, stations: List[int], mobile: bool) -> List[Dict[str, Any]]:
+    now_ts = time.time()
+    now = dt.datetime.fromtimestamp(now_ts, ET_TZ)
+    payloads = {
+        name: synthetic_feed(name, now_ts, trips=trips, stops_per_trip=per_trip, watched=())
+        .SerializeToString()
+        for name, (trips, per_trip) in FEED_SIZES.items()
+    }
+    feeds = {name: parse_feed(payload) for name, payload in payloads.items()}
+    if mobile:
+        from server import render_mobile
+
+    results = []
+
+    def record(stage: str, count: int, fn: Callable[[], Any], **extra: Any) -> None:
+        entry = {"stage": stage, "stations": count, **extra, **measure(fn, repeat)}
+        results.append(entry)
+        print(
+            f"{stage:<16} {count:>4} stations  median {entry['median_ms']:>9.3f} ms  "
+            f"p95 {entry['p95_ms']:>9.3f} ms  peak {entry['peak_kb']:>9.1f} KB",
+            file=sys.stderr,
+        )
+
+    big = payloads["gtfs"]
+    record("parse_feed", 0, lambda: parse_feed(big), bytes=len(big))
+    for count in stations:
+        stop_map = station_map(count)
+        index = StopIndex(stop_map)
+        record("extract_arrivals", count, lambda: extract_arrivals(big, index), bytes=len(big))
+        record("iter_arrivals", count, lambda: list(iter_arrivals(feeds["gtfs"], index)))
+        record("build_schedule", count, lambda: build_schedule(feeds.values(), index, now, limit=2))
+
+        arrivals = {name: extract_arrivals(payload, index) for name, payload in payloads.items()}
+
+        def apply_all() -> ScheduleIndex:
+            schedule = ScheduleIndex()
+            for name, rows in arrivals.items():
+                schedule.apply(name, rows, now_ts)
+            return schedule
+
+        record("index_apply", count, apply_all)
+        stops = apply_all().view()
+        record("schedule_rows", count, lambda: schedule_rows(stops, stop_map, now, limit=None))
+
+        svg_rows = build_schedule(feeds.values(), index, now, limit=2)
+        all_rows = schedule_rows(stops, stop_map, now, limit=None)
+        record("render_svg", count, lambda: render_svg(svg_rows, now), rows=len(svg_rows))
+        if mobile:
+            record("render_mobile", count, lambda: render_mobile(all_rows, now), rows=len(all_rows))
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.strip()
+
+
+def compare(base_path: str, results: List[Dict[str, Any]]) -> bool:
+    with open(base_path, "r", encoding="utf-8") as handle:
+        base = {(r["stage"], r["stations"]): r for r in json.load(handle)["results"]}
+    regressed = False
+    for entry in results:
+        old = base.get((entry["stage"], entry["stations"]))
+        if old is None or not old["median_ms"]:
+            continue
+        ratio = entry["median_ms"] / old["median_ms"]
+        flag = "REGRESSION" if ratio > REGRESSION_RATIO else ""
+        regressed = regressed or bool(flag)
+        print(
+            f"{entry['stage']:<16} {entry['stations']:>4}  {old['median_ms']:>9.3f} -> "
+            f"{entry['median_ms']:>9.3f} ms  x{ratio:.2f} {flag}"
+        )
+    return not regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the parse, schedule and render hot paths.")
+    parser.add_argument("-n", "--repeat", type=int, default=20)
+    parser.add_argument("--stations", type=int, nargs="+", default=list(STATION_COUNTS))
+    parser.add_argument("--no-mobile", action="store_true", help="skip render_mobile (imports server.py)")
+    parser.add_argument("-o", "--output", default="bench_results.json")
+    parser.add_argument("--compare", default="", help="earlier results file; exit 1 on regression")
+    args = parser.parse_args()
+
+    results = run(args.repeat, args.stations, mobile=not args.no_mobile)
+    report = {
+        "revision": git_revision(),
+        "created": dt.datetime.now(dt.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as handle:
+        json.dump(report, handle, indent=2)
+    print(f"Wrote {args.output}")
+    if args.compare and not compare(args.compare, results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
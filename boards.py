@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from typing import Dict, List
+
+from timetable_svg import MY_STOPS, resolve_stops
+
+# JSON object of board id -> stop map ({"G21": "Queens Plaza"}) or a list of
+# stop ids whose names are looked up in the static index.
+BOARDS_FILE = os.getenv("BOARDS_FILE", "")
+DEFAULT_BOARD = "default"
+
+
+def load_boards(path: str = BOARDS_FILE) -> Dict[str, Dict[str, str]]:
+    boards = {DEFAULT_BOARD: dict(MY_STOPS)}
+    if not path:
+        return boards
+    with open(path, "r", encoding="utf-8") as handle:
+        data = json.load(handle)
+    for board_id, stops in data.items():
+        boards[str(board_id)] = dict(stops) if isinstance(stops, dict) else resolve_stops(stops)
+    return boards
+
+
+def watched_stops(boards: Dict[str, Dict[str, str]]) -> Dict[str, str]:
+    """Union of every board's stops, so one ingestion pass serves them all."""
+    merged: Dict[str, str] = {}
+    for stop_map in boards.values():
+        for stop_id, name in stop_map.items():
+            merged.setdefault(stop_id, name)
+    return merged
+
+
+def parse_stop_ids(value: str) -> List[str]:
+    return [stop_id.strip() for stop_id in value.split(",") if stop_id.strip()]
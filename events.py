@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+
+import json
+from typing import Dict, List, Tuple
+
+from timetable_svg import ScheduleRow, route_color
+
+RowMap = Dict[str, Dict[str, object]]
+
+
+def row_key(row: ScheduleRow) -> str:
+    return f"{row.route}|{row.stop_name}|{row.direction}"
+
+
+def rows_by_key(rows: List[ScheduleRow]) -> RowMap:
+    # Compact wire form shared by the live stream: epoch times, short keys.
+    return {
+        row_key(row): {
+            "k": row_key(row),
+            "r": row.route,
+            "s": row.stop_name,
+            "d": row.direction,
+            "c": route_color(row.route),
+            "t": list(row.times),
+        }
+        for row in rows
+    }
+
+
+def diff_rows(previous: RowMap, current: RowMap) -> Tuple[List[Dict[str, object]], List[str]]:
+    changed = [row for key, row in current.items() if previous.get(key) != row]
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+def format_event(event: str, data: Dict[str, object], event_id: int | None = None) -> bytes:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+    return ("\n".join(lines) + "\n\n").encode("utf-8")
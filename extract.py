@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+
+import bisect
+import re
+import sys
+from typing import Dict, Iterator, List, NamedTuple, Tuple
+
+from google.protobuf.message import DecodeError
+from google.transit import gtfs_realtime_pb2
+
+DIRECTIONS = {"N": "Uptown", "S": "Downtown"}
+
+# FeedMessage field numbers (gtfs-realtime.proto).
+_ENTITY_FIELD = 2
+
+# Up to this many stop_ids, repeated bytes.find() beats one regex alternation.
+_FIND_LIMIT = 24
+# Past this many stop_ids most entities mention one anyway, and scanning for
+# them costs more than decoding the whole feed (bench.py: ~30-50 stations).
+_PREFILTER_LIMIT = 64
+
+
+class Arrival(NamedTuple):
+    route: str
+    stop_id: str
+    direction: str
+    time: int
+    trip_id: str
+
+
+class StopIndex:
+    """Watched stops keyed by their full GTFS-RT stop_id (with N/S suffix).
+
+    Lookups are a single dict hit per stop_time_update instead of slicing the
+    suffix off every row, and ``pattern`` finds the raw bytes of any watched
+    stop so entities that can't match are never decoded. The (stop, direction)
+    strings are interned once here and shared by every Arrival.
+    """
+
+    def __init__(self, stop_map: Dict[str, str]) -> None:
+        self.stop_map = dict(stop_map)
+        self.lookup: Dict[str, Tuple[str, str]] = {}
+        for stop_key in self.stop_map:
+            for flag in DIRECTIONS:
+                self.lookup[stop_key + flag] = (sys.intern(stop_key), sys.intern(flag))
+        needles = sorted((sid.encode("utf-8") for sid in self.lookup), key=len, reverse=True)
+        self.needles = tuple(needles)
+        self.pattern = re.compile(b"|".join(re.escape(n) for n in needles)) if needles else None
+
+    def find_hits(self, payload: bytes) -> List[int]:
+        """Sorted offsets in ``payload`` where a watched stop_id appears."""
+        if len(self.needles) > _FIND_LIMIT:
+            return [m.start() for m in self.pattern.finditer(payload)]
+        hits = []
+        for needle in self.needles:
+            pos = payload.find(needle)
+            while pos != -1:
+                hits.append(pos)
+                pos = payload.find(needle, pos + 1)
+        hits.sort()
+        return hits
+
+
+def iter_entity_spans(payload: bytes) -> Iterator[Tuple[int, int]]:
+    # Walks the top level of a serialized FeedMessage and yields the byte
+    # range of each FeedEntity without decoding it.
+    pos = 0
+    end = len(payload)
+    while pos < end:
+        key, pos = _read_varint(payload, pos)
+        field, wire_type = key >> 3, key & 0x7
+        if wire_type == 2:
+            length, pos = _read_varint(payload, pos)
+            if field == _ENTITY_FIELD:
+                yield pos, pos + length
+            pos += length
+        elif wire_type == 0:
+            _, pos = _read_varint(payload, pos)
+        elif wire_type == 1:
+            pos += 8
+        elif wire_type == 5:
+            pos += 4
+        else:
+            raise DecodeError(f"Unsupported wire type {wire_type} at offset {pos}")
+    if pos != end:
+        raise DecodeError("Truncated FeedMessage")
+
+
+def _read_varint(buf: bytes, pos: int) -> Tuple[int, int]:
+    result = 0
+    shift = 0
+    while True:
+        try:
+            byte = buf[pos]
+        except IndexError:
+            raise DecodeError("Truncated varint") from None
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+
+
+def entity_arrivals(
+    entity: gtfs_realtime_pb2.FeedEntity,
+    index: StopIndex,
+) -> Iterator[Arrival]:
+    # Unset submessages read as defaults (time == 0), so no HasField checks.
+    trip_update = entity.trip_update
+    trip = trip_update.trip
+    route = None
+    lookup = index.lookup
+    for stu in trip_update.stop_time_update:
+        hit = lookup.get(stu.stop_id)
+        if hit is None:
+            continue
+        ts = stu.arrival.time or stu.departure.time
+        if not ts:
+            continue
+        if route is None:
+            route = sys.intern(trip.route_id)
+        yield Arrival(route, hit[0], hit[1], ts, trip.trip_id)
+
+
+def iter_feed_arrivals(
+    feed: gtfs_realtime_pb2.FeedMessage,
+    index: StopIndex,
+) -> Iterator[Arrival]:
+    for entity in feed.entity:
+        yield from entity_arrivals(entity, index)
+
+
+def extract_arrivals(payload: bytes, index: StopIndex) -> List[Arrival]:
+    """Decode only the entities of a serialized feed that mention a watched stop."""
+    if len(index.needles) > _PREFILTER_LIMIT:
+        return list(iter_feed_arrivals(gtfs_realtime_pb2.FeedMessage.FromString(payload), index))
+    # Locate watched stop_ids in the raw bytes once; entities with no hit
+    # inside their byte range are skipped without decoding.
+    hits = index.find_hits(payload)
+    if not hits:
+        return []
+    arrivals: List[Arrival] = []
+    parse_entity = gtfs_realtime_pb2.FeedEntity.FromString
+    for start, stop in iter_entity_spans(payload):
+        i = bisect.bisect_left(hits, start)
+        if i == len(hits) or hits[i] >= stop:
+            continue
+        arrivals.extend(entity_arrivals(parse_entity(payload[start:stop]), index))
+    return arrivals
+
+
+def stop_index_for(stop_map: Dict[str, str] | StopIndex) -> StopIndex:
+    return stop_map if isinstance(stop_map, StopIndex) else StopIndex(stop_map)
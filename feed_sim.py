@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Sequence, Tuple
+
+from google.transit import gtfs_realtime_pb2
+
+from feeds import feed_name, get_session
+from timetable_svg import ALL_FEED_URLS, MY_STOPS, ROUTE_FEEDS
+
+log = logging.getLogger(__name__)
+
+# feed name ("gtfs-ace") -> routes it carries
+FEED_ROUTES: Dict[str, List[str]] = defaultdict(list)
+for _route, _url in ROUTE_FEEDS.items():
+    FEED_ROUTES[feed_name(_url)].append(_route)
+
+
+@dataclass(frozen=True)
+class SimConfig:
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    trips: int = 300
+    stops_per_trip: int = 30
+    # Share of stop updates that land on the watched stops.
+    watch_rate: float = 0.05
+    # Seconds between feed versions; also the headway between trips.
+    update_interval: float = 30.0
+    seed: int = 1
+    replay_dir: str = ""
+
+
+def synthetic_feed(
+    name: str,
+    now: float,
+    trips: int = 300,
+    stops_per_trip: int = 30,
+    watched: Sequence[str] = tuple(MY_STOPS),
+    watch_rate: float = 0.05,
+    headway: float = 30.0,
+    seed: int = 1,
+) -> gtfs_realtime_pb2.FeedMessage:
+    """A plausible GTFS-RT feed for ``name`` at ``now``.
+
+    Trips are laid out on a fixed timeline (one every ``headway`` seconds), so
+    consecutive versions share most trips: old ones fall off, a new one
+    appears and a few pick up delays, the way a real feed drifts.
+    """
+    routes = FEED_ROUTES.get(name) or ["A"]
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    feed.header.timestamp = int(now)
+    tick = int(now // headway)
+    first = tick - trips // 10
+    for n in range(first, first + trips):
+        rng = random.Random(f"{seed}:{name}:{n}")
+        delay = random.Random(f"{seed}:{name}:{n}:{tick}").choice((0,) * 9 + (60,))
+        start = n * headway + delay
+        entity = feed.entity.add()
+        entity.id = f"{n}"
+        trip_update = entity.trip_update
+        trip_update.trip.trip_id = f"{name}_{n}"
+        trip_update.trip.route_id = rng.choice(routes)
+        direction = rng.choice("NS")
+        for j in range(stops_per_trip):
+            update = trip_update.stop_time_update.add()
+            if watched and rng.random() < watch_rate:
+                stop_id = rng.choice(watched)
+            else:
+                stop_id = f"{rng.randint(100, 999)}"
+            update.stop_id = stop_id + direction
+            arrival = int(start + j * 90)
+            update.arrival.time = arrival
+            update.departure.time = arrival + 30
+        if n % 10 == 0:
+            vehicle = feed.entity.add()
+            vehicle.id = f"v{n}"
+            vehicle.vehicle.trip.trip_id = f"{name}_{n}"
+    return feed
+
+
+class FeedSimulator:
+    """Serves one payload per feed name, synthetic or replayed from files.
+
+    Replay files are ``<replay_dir>/<feed name>*.pb``, served in sorted order
+    and advanced every ``update_interval`` seconds. Payloads are cached per
+    version, so each one is built once no matter how many clients poll.
+    """
+
+    def __init__(self, config: SimConfig) -> None:
+        self.config = config
+        self._cache: Dict[Tuple[str, int], bytes] = {}
+        self._lock = threading.Lock()
+        self._recordings: Dict[str, List[str]] = {}
+        if config.replay_dir:
+            for path in sorted(glob.glob(os.path.join(config.replay_dir, "*.pb"))):
+                base = os.path.basename(path)[:-3]
+                for name in sorted(FEED_ROUTES, key=len, reverse=True):
+                    if base == name or base.startswith(name + "-"):
+                        self._recordings.setdefault(name, []).append(path)
+                        break
+
+    def payload(self, name: str, now: float | None = None) -> bytes | None:
+        if name not in FEED_ROUTES:
+            return None
+        now = time.time() if now is None else now
+        version = int(now // self.config.update_interval)
+        key = (name, version)
+        with self._lock:
+            body = self._cache.get(key)
+        if body is not None:
+            return body
+
+        recordings = self._recordings.get(name)
+        if recordings:
+            with open(recordings[version % len(recordings)], "rb") as handle:
+                body = handle.read()
+        elif self.config.replay_dir:
+            return None
+        else:
+            body = synthetic_feed(
+                name,
+                version * self.config.update_interval,
+                trips=self.config.trips,
+                stops_per_trip=self.config.stops_per_trip,
+                watch_rate=self.config.watch_rate,
+                headway=self.config.update_interval,
+                seed=self.config.seed,
+            ).SerializeToString()
+        with self._lock:
+            self._cache = {k: v for k, v in self._cache.items() if k[1] >= version - 1}
+            self._cache[key] = body
+        return body
+
+    def delay(self) -> float:
+        jitter = self.config.jitter
+        return max(0.0, self.config.latency + random.uniform(-jitter, jitter))
+
+    def should_fail(self) -> bool:
+        return random.random() < self.config.error_rate
+
+
+def make_handler(simulator: FeedSimulator):
+    class SimHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:
+            time.sleep(simulator.delay())
+            if simulator.should_fail():
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            body = simulator.payload(feed_name(self.path.split("?", 1)[0]))
+            if body is None:
+                self.send_response(404)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-protobuf")
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args) -> None:
+            return
+
+    return SimHandler
+
+
+def make_sim_server(host: str, port: int, config: SimConfig) -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), make_handler(FeedSimulator(config)))
+    server.daemon_threads = True
+    return server
+
+
+def record(out_dir: str, urls: Sequence[str] = ALL_FEED_URLS) -> List[str]:
+    """Save one live copy of each feed for later replay."""
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%dT%H%M%S")
+    written = []
+    for url in urls:
+        resp = get_session().get(url, timeout=10)
+        resp.raise_for_status()
+        path = os.path.join(out_dir, f"{feed_name(url)}-{stamp}.pb")
+        with open(path, "wb") as handle:
+            handle.write(resp.content)
+        written.append(path)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve stand-in MTA GTFS-RT feeds locally.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="+/- seconds around --latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered 503")
+    parser.add_argument("--trips", type=int, default=300, help="trips per feed")
+    parser.add_argument("--stops-per-trip", type=int, default=30)
+    parser.add_argument("--watch-rate", type=float, default=0.05)
+    parser.add_argument("--update-interval", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", default="", help="directory of recorded <feed>-*.pb files")
+    parser.add_argument("--record", default="", help="save live feeds to this directory and exit")
+    args = parser.parse_args()
+
+    if args.record:
+        for path in record(args.record):
+            print(f"Wrote {path}")
+        return
+
+    config = SimConfig(
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        trips=args.trips,
+        stops_per_trip=args.stops_per_trip,
+        watch_rate=args.watch_rate,
+        update_interval=args.update_interval,
+        seed=args.seed,
+        replay_dir=args.replay,
+    )
+    server = make_sim_server(args.host, args.port, config)
+    host, port = server.server_address[:2]
+    print(f"Serving feeds on http://{host}:{port} "
+          f"(MTA_FEED_BASE=http://{host}:{port}/Dataservice/mtagtfsfeeds)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
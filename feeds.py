@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Dict, Iterable
+
+import requests
+from google.transit import gtfs_realtime_pb2
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 10.0
+POOL_SIZE = 8
+
+# Seconds the last good copy of a feed may be served while its URL fails.
+MAX_STALE = float(os.getenv("FEED_MAX_STALE", "300"))
+# Consecutive failures before a URL's circuit opens, and the backoff between
+# attempts while it is failing (doubling from BACKOFF_BASE up to BACKOFF_MAX).
+FAILURE_THRESHOLD = int(os.getenv("FEED_FAILURE_THRESHOLD", "3"))
+BACKOFF_BASE = float(os.getenv("FEED_BACKOFF_BASE", "5"))
+BACKOFF_MAX = float(os.getenv("FEED_BACKOFF_MAX", "300"))
+
+FETCH_SECONDS = metrics.histogram(
+    "mta_feed_fetch_seconds", "Upstream feed request latency.", ("feed", "result")
+)
+FETCH_BYTES = metrics.counter("mta_feed_bytes_total", "Feed body bytes downloaded.", ("feed",))
+PARSE_SECONDS = metrics.histogram("mta_feed_parse_seconds", "Time to decode a changed feed body.", ("feed",))
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="feed-fetch")
+
+
+def get_session() -> requests.Session:
+    # One keep-alive pool shared by every fetch, so repeated polls reuse the
+    # TCP/TLS connection to api-endpoint.mta.info.
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def body_digest(body: bytes) -> str:
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def parse_feed(payload: bytes) -> gtfs_realtime_pb2.FeedMessage:
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(payload)
+    return feed
+
+
+def feed_name(url: str) -> str:
+    # ".../mtagtfsfeeds/nyct%2Fgtfs-ace" -> "gtfs-ace"
+    return url.rstrip("/").rsplit("/", 1)[-1].rsplit("%2F", 1)[-1]
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, url: str, retry_in: float) -> None:
+        super().__init__(f"circuit open for {feed_name(url)}")
+        self.url = url
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with jittered exponential backoff.
+
+    After ``threshold`` failures in a row the circuit opens and calls are
+    refused until the backoff elapses; then a single trial call is let
+    through (half-open), which either closes the circuit or reopens it with
+    a doubled delay. Callers hold the owning fetcher's lock.
+    """
+
+    def __init__(
+        self,
+        threshold: int = FAILURE_THRESHOLD,
+        base_delay: float = BACKOFF_BASE,
+        max_delay: float = BACKOFF_MAX,
+    ) -> None:
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return "closed"
+        return "open" if time.monotonic() < self.retry_at else "half-open"
+
+    def allow(self) -> bool:
+        if self.failures < self.threshold:
+            return True
+        now = time.monotonic()
+        if now < self.retry_at:
+            return False
+        # Half-open: hold the circuit for one trial call's worth of time.
+        self.retry_at = now + DEFAULT_TIMEOUT
+        return True
+
+    def retry_in(self) -> float:
+        return max(0.0, self.retry_at - time.monotonic()) if self.failures else 0.0
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.retry_at = 0.0
+
+    def record_failure(self) -> float:
+        self.failures += 1
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.failures - 1))
+        # Equal jitter keeps a floor on the delay but spreads retries out.
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.retry_at = time.monotonic() + delay
+        return delay
+
+
+@dataclass(frozen=True)
+class FetchResult:
+    url: str
+    decoded: Any
+    digest: str
+    changed: bool
+    # When the upstream last answered successfully (wall clock).
+    fetched_at: float = 0.0
+    # Set when the fetch failed and ``decoded`` is the last good copy.
+    error: str | None = None
+    # The raw body, only when it changed.
+    body: bytes | None = None
+
+
+@dataclass(frozen=True)
+class FeedStatus:
+    url: str
+    fetched_at: float | None
+    failures: int
+    error: str | None
+    circuit: str
+
+    def age(self, now: float | None = None) -> float | None:
+        if self.fetched_at is None:
+            return None
+        return max(0.0, (now or time.time()) - self.fetched_at)
+
+
+@dataclass(frozen=True)
+class _CacheEntry:
+    etag: str | None
+    last_modified: str | None
+    digest: str
+    decoded: Any
+    fetched_at: float
+
+
+class FeedFetcher:
+    """Fetches feeds with conditional GETs and skips decoding unchanged bodies.
+
+    Validators, a content digest and the last decoded result are kept per URL;
+    a 304 or an identical body returns the cached result with ``changed`` False.
+    ``decode`` turns the raw body into whatever the caller keeps (a parsed
+    FeedMessage by default).
+
+    Each URL has its own circuit breaker. While a URL fails (or its circuit
+    is open) the last good result is returned with ``error`` set, for up to
+    ``max_stale`` seconds after its last successful fetch; after that the
+    failure is raised.
+    """
+
+    def __init__(
+        self,
+        session: requests.Session | None = None,
+        decode: Callable[[bytes], Any] = parse_feed,
+        max_stale: float = MAX_STALE,
+        breaker_factory: Callable[[], CircuitBreaker] = CircuitBreaker,
+    ) -> None:
+        self._session = session
+        self._decode = decode
+        self.max_stale = max_stale
+        self._breaker_factory = breaker_factory
+        self._cache: Dict[str, _CacheEntry] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._errors: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def retry_in(self, url: str) -> float:
+        """Seconds until ``url`` should next be tried (0 when healthy)."""
+        with self._lock:
+            breaker = self._breakers.get(url)
+            return breaker.retry_in() if breaker is not None else 0.0
+
+    def status(self, url: str) -> FeedStatus:
+        with self._lock:
+            cached = self._cache.get(url)
+            breaker = self._breakers.get(url)
+            return FeedStatus(
+                url,
+                cached.fetched_at if cached is not None else None,
+                breaker.failures if breaker is not None else 0,
+                self._errors.get(url),
+                breaker.state if breaker is not None else "closed",
+            )
+
+    def seed(self, url: str, decoded: Any, digest: str, fetched_at: float, error: str | None = None) -> None:
+        """Prime ``url``'s cache (e.g. from disk) so an identical body is not decoded again.
+
+        ``error`` is reported by ``status`` until the next successful fetch.
+        """
+        with self._lock:
+            self._cache[url] = _CacheEntry(None, None, digest, decoded, fetched_at)
+            if error:
+                self._errors[url] = error
+
+    def fetch(self, url: str, timeout: float = DEFAULT_TIMEOUT) -> FetchResult:
+        with self._lock:
+            breaker = self._breakers.get(url)
+            if breaker is None:
+                breaker = self._breakers[url] = self._breaker_factory()
+            allowed = breaker.allow()
+            retry_in = breaker.retry_in()
+        try:
+            if not allowed:
+                raise CircuitOpenError(url, retry_in)
+            result = self._fetch(url, timeout)
+        except Exception as exc:
+            with self._lock:
+                if not isinstance(exc, CircuitOpenError):
+                    breaker.record_failure()
+                error = self._errors[url] = str(exc) or type(exc).__name__
+                cached = self._cache.get(url)
+            if cached is None or time.time() - cached.fetched_at > self.max_stale:
+                raise
+            return FetchResult(url, cached.decoded, cached.digest, False, cached.fetched_at, error)
+        with self._lock:
+            breaker.record_success()
+            self._errors.pop(url, None)
+        return result
+
+    def _fetch(self, url: str, timeout: float) -> FetchResult:
+        with self._lock:
+            cached = self._cache.get(url)
+        headers: Dict[str, str] = {}
+        if cached is not None:
+            if cached.etag:
+                headers["If-None-Match"] = cached.etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+
+        session = self._session or get_session()
+        name = feed_name(url)
+        started = time.perf_counter()
+        try:
+            resp = session.get(url, timeout=timeout, headers=headers)
+        except Exception:
+            FETCH_SECONDS.observe(time.perf_counter() - started, feed=name, result="error")
+            raise
+        fetched_at = time.time()
+        if resp.status_code == 304 and cached is not None:
+            FETCH_SECONDS.observe(time.perf_counter() - started, feed=name, result="not_modified")
+            with self._lock:
+                self._cache[url] = replace(cached, fetched_at=fetched_at)
+            return FetchResult(url, cached.decoded, cached.digest, False, fetched_at)
+        result = "ok" if resp.status_code < 400 else "error"
+        FETCH_SECONDS.observe(time.perf_counter() - started, feed=name, result=result)
+        resp.raise_for_status()
+
+        body = resp.content
+        FETCH_BYTES.inc(len(body), feed=name)
+        digest = body_digest(body)
+        if cached is not None and cached.digest == digest:
+            decoded = cached.decoded
+            changed = False
+        else:
+            with PARSE_SECONDS.time(feed=name):
+                decoded = self._decode(body)
+            changed = True
+
+        entry = _CacheEntry(
+            etag=resp.headers.get("ETag"),
+            last_modified=resp.headers.get("Last-Modified"),
+            digest=digest,
+            decoded=decoded,
+            fetched_at=fetched_at,
+        )
+        with self._lock:
+            self._cache[url] = entry
+        return FetchResult(url, decoded, digest, changed, fetched_at, body=body if changed else None)
+
+
+default_fetcher = FeedFetcher()
+
+
+def fetch_feed(url: str, timeout: float = DEFAULT_TIMEOUT) -> gtfs_realtime_pb2.FeedMessage:
+    return default_fetcher.fetch(url, timeout).decoded
+
+
+def fetch_feeds(
+    urls: Iterable[str],
+    timeout: float = DEFAULT_TIMEOUT,
+    timeouts: Dict[str, float] | None = None,
+) -> Dict[str, gtfs_realtime_pb2.FeedMessage]:
+    """Fetch feeds concurrently, returning whichever finish within their timeout.
+
+    Feeds that fail or miss their deadline are left out of the result, so the
+    call takes at most as long as the largest per-feed timeout.
+    """
+    timeouts = timeouts or {}
+    started = time.monotonic()
+    futures = {}
+    for url in urls:
+        feed_timeout = timeouts.get(url, timeout)
+        futures[url] = (_executor.submit(fetch_feed, url, feed_timeout), feed_timeout)
+
+    results: Dict[str, gtfs_realtime_pb2.FeedMessage] = {}
+    for url, (future, feed_timeout) in futures.items():
+        remaining = max(0.0, started + feed_timeout - time.monotonic())
+        try:
+            results[url] = future.result(timeout=remaining)
+        except Exception as exc:
+            log.warning("skipping feed %s: %s", url, exc or type(exc).__name__)
+    return results
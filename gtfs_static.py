@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import io
+import logging
+import os
+import sqlite3
+import threading
+import zipfile
+from functools import lru_cache
+from typing import Any, Callable, Dict, FrozenSet, Iterable, Iterator, List, Set, Tuple
+
+log = logging.getLogger(__name__)
+
+SUBWAY_DATA = "https://rrgtfsfeeds.s3.amazonaws.com/gtfs_subway.zip"
+_HERE = os.path.dirname(os.path.abspath(__file__))
+STATIC_GTFS = os.getenv("GTFS_STATIC", os.path.join(_HERE, "gtfs_subway.zip"))
+STATIC_INDEX = os.getenv("GTFS_INDEX", os.path.join(_HERE, "gtfs_index.sqlite"))
+
+MMAP_SIZE = 64 * 1024 * 1024
+# Lookups memoized per StaticIndex; ids outside the index (e.g. typos in
+# ?stops=) stop being cached past this.
+CACHE_LIMIT = 16384
+
+SCHEMA = """
+CREATE TABLE stops (stop_id TEXT PRIMARY KEY, name TEXT NOT NULL, parent TEXT) WITHOUT ROWID;
+CREATE TABLE routes (
+    route_id TEXT PRIMARY KEY, short_name TEXT, color TEXT, text_color TEXT
+) WITHOUT ROWID;
+CREATE TABLE stop_routes (
+    stop_id TEXT NOT NULL, route_id TEXT NOT NULL, PRIMARY KEY (stop_id, route_id)
+) WITHOUT ROWID;
+CREATE TABLE headsigns (
+    route_id TEXT NOT NULL, direction TEXT NOT NULL, headsign TEXT NOT NULL,
+    PRIMARY KEY (route_id, direction)
+) WITHOUT ROWID;
+"""
+
+
+def _read_csv(archive: zipfile.ZipFile, name: str) -> Iterator[Dict[str, str]]:
+    with archive.open(name) as raw:
+        yield from csv.DictReader(io.TextIOWrapper(raw, encoding="utf-8-sig"))
+
+
+@lru_cache(maxsize=4)
+def load_stop_routes(path: str) -> Dict[str, FrozenSet[str]]:
+    """Map every stop_id (platforms and their parent station) to the routes
+    scheduled to stop there, from a static GTFS zip."""
+    with zipfile.ZipFile(path) as archive:
+        parents = {
+            row["stop_id"]: row.get("parent_station") or ""
+            for row in _read_csv(archive, "stops.txt")
+        }
+        trip_routes = {row["trip_id"]: row["route_id"] for row in _read_csv(archive, "trips.txt")}
+        stop_routes: Dict[str, Set[str]] = {}
+        for row in _read_csv(archive, "stop_times.txt"):
+            route = trip_routes.get(row["trip_id"])
+            if route is None:
+                continue
+            stop_id = row["stop_id"]
+            stop_routes.setdefault(stop_id, set()).add(route)
+            parent = parents.get(stop_id)
+            if parent:
+                stop_routes.setdefault(parent, set()).add(route)
+    return {stop_id: frozenset(routes) for stop_id, routes in stop_routes.items()}
+
+
+def _first(rows: List[Tuple]) -> Any:
+    return rows[0][0] if rows else None
+
+
+def _color(value: str | None) -> str | None:
+    return f"#{value.upper()}" if value else None
+
+
+def build_index(zip_path: str, out_path: str = STATIC_INDEX) -> str:
+    """Import a static GTFS zip into the compact SQLite index read by StaticIndex."""
+    stop_routes = load_stop_routes(zip_path)
+    with zipfile.ZipFile(zip_path) as archive:
+        stops = [
+            (row["stop_id"], row["stop_name"], row.get("parent_station") or None)
+            for row in _read_csv(archive, "stops.txt")
+        ]
+        routes = [
+            (
+                row["route_id"],
+                row.get("route_short_name") or row["route_id"],
+                _color(row.get("route_color")),
+                _color(row.get("route_text_color")),
+            )
+            for row in _read_csv(archive, "routes.txt")
+        ]
+        # Most common headsign per (route, direction); N/S match the RT suffixes.
+        counts: Dict[Tuple[str, str, str], int] = {}
+        for row in _read_csv(archive, "trips.txt"):
+            headsign = row.get("trip_headsign")
+            if not headsign:
+                continue
+            direction = "S" if row.get("direction_id") == "1" else "N"
+            key = (row["route_id"], direction, headsign)
+            counts[key] = counts.get(key, 0) + 1
+    best: Dict[Tuple[str, str], Tuple[int, str]] = {}
+    for (route_id, direction, headsign), count in counts.items():
+        if count > best.get((route_id, direction), (0, ""))[0]:
+            best[(route_id, direction)] = (count, headsign)
+
+    tmp_path = out_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT OR REPLACE INTO stops VALUES (?, ?, ?)", stops)
+        conn.executemany("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?)", routes)
+        conn.executemany(
+            "INSERT INTO stop_routes VALUES (?, ?)",
+            [(stop_id, route) for stop_id, rs in stop_routes.items() for route in sorted(rs)],
+        )
+        conn.executemany(
+            "INSERT INTO headsigns VALUES (?, ?, ?)",
+            [(route_id, direction, headsign) for (route_id, direction), (_, headsign) in best.items()],
+        )
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+class StaticIndex:
+    """Read-only, memory-mapped view of the SQLite index built by build_index()."""
+
+    def __init__(self, path: str = STATIC_INDEX) -> None:
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self._lock = threading.Lock()
+        self._cache: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+
+    def _query(self, sql: str, params: Tuple[str, ...]) -> List[Tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+            self._cache.clear()
+
+    def _lookup(self, sql: str, params: Tuple[str, ...], convert: Callable[[List[Tuple]], Any]) -> Any:
+        # Memoized per instance; the index is read-only, so entries never go stale.
+        key = (sql, params)
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        value = convert(self._query(sql, params))
+        if len(self._cache) < CACHE_LIMIT:
+            self._cache[key] = value
+        return value
+
+    def stop_name(self, stop_id: str) -> str | None:
+        return self._lookup("SELECT name FROM stops WHERE stop_id = ?", (stop_id,), _first)
+
+    def parent_station(self, stop_id: str) -> str | None:
+        return self._lookup("SELECT parent FROM stops WHERE stop_id = ?", (stop_id,), _first)
+
+    def route_color(self, route_id: str) -> str | None:
+        return self._lookup("SELECT color FROM routes WHERE route_id = ?", (route_id,), _first)
+
+    def headsign(self, route_id: str, direction: str) -> str | None:
+        return self._lookup(
+            "SELECT headsign FROM headsigns WHERE route_id = ? AND direction = ?",
+            (route_id, direction),
+            _first,
+        )
+
+    def routes_at(self, stop_id: str) -> FrozenSet[str]:
+        return self._lookup(
+            "SELECT route_id FROM stop_routes WHERE stop_id = ?",
+            (stop_id,),
+            lambda rows: frozenset(row[0] for row in rows),
+        )
+
+
+@lru_cache(maxsize=1)
+def load_static_index(path: str = STATIC_INDEX) -> StaticIndex | None:
+    if not os.path.exists(path):
+        return None
+    try:
+        return StaticIndex(path)
+    except sqlite3.Error as exc:
+        log.warning("could not open static index %s: %s", path, exc)
+        return None
+
+
+def close_static_index() -> None:
+    """Close the shared index; the next load_static_index() opens a new one.
+
+    SQLite connections must not be used across fork(), so call this before
+    forking and let each child open its own.
+    """
+    if load_static_index.cache_info().currsize:
+        index = load_static_index()
+        if index is not None:
+            index.close()
+    load_static_index.cache_clear()
+
+
+def routes_for_stops(stop_ids: Iterable[str], path: str = STATIC_GTFS) -> Set[str] | None:
+    """Routes serving any of ``stop_ids``, or None if no static data is available."""
+    index = load_static_index()
+    if index is not None:
+        routes: Set[str] = set()
+        for stop_id in stop_ids:
+            routes.update(index.routes_at(stop_id))
+        return routes
+    if not os.path.exists(path):
+        return None
+    try:
+        stop_routes = load_stop_routes(path)
+    except (OSError, KeyError, zipfile.BadZipFile, csv.Error) as exc:
+        log.warning("could not read static GTFS %s: %s", path, exc)
+        return None
+    routes = set()
+    for stop_id in stop_ids:
+        routes.update(stop_routes.get(stop_id, ()))
+    return routes
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build the static GTFS lookup index.")
+    parser.add_argument("zip_path", nargs="?", default=STATIC_GTFS)
+    parser.add_argument("-o", "--output", default=STATIC_INDEX)
+    args = parser.parse_args()
+    out_path = build_index(args.zip_path, args.output)
+    print(f"Wrote {out_path}")
+
+
+if __name__ == "__main__":
+    main()
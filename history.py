@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+
+import argparse
+import calendar
+import csv
+import datetime as dt
+import glob
+import logging
+import marshal
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+
+from extract import Arrival
+
+log = logging.getLogger(__name__)
+
+# Recording is off unless a directory is configured.
+HISTORY_DIR = os.getenv("HISTORY_DIR", "")
+# Each segment file covers this many seconds of observations.
+SEGMENT_SECONDS = int(os.getenv("HISTORY_SEGMENT_SECONDS", "3600"))
+# Segments older than this many days are deleted on rotation (0 keeps all).
+RETAIN_DAYS = float(os.getenv("HISTORY_RETAIN_DAYS", "0"))
+# Rows buffered in memory before a chunk is appended to the segment.
+CHUNK_ROWS = 4096
+
+# A segment is a sequence of self-contained chunks:
+#   magic "MTAH", u32 row count, u32 min/max observed-at, u32 string table length,
+#   marshal'd (trips, routes, stops, directions) string tables, then one
+#   little-endian column per field in COLUMNS order. String columns hold
+#   indexes into the chunk's own table, so nothing grows across chunks and a
+#   torn write only loses the last chunk.
+MAGIC = b"MTAH"
+_CHUNK = struct.Struct("<4sIIII")
+COLUMNS = (
+    ("observed_at", "I"),
+    ("predicted", "I"),
+    ("trip", "I"),
+    ("route", "H"),
+    ("stop", "H"),
+    ("direction", "B"),
+)
+_STRING_COLUMNS = ("trip", "route", "stop", "direction")
+_SEGMENT_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+class Observation(NamedTuple):
+    observed_at: int
+    trip_id: str
+    route: str
+    stop_id: str
+    direction: str
+    predicted: int
+
+
+def segment_name(start: int) -> str:
+    return f"history-{time.strftime(_SEGMENT_FORMAT, time.gmtime(start))}.seg"
+
+
+def segment_start(path: str) -> int | None:
+    name = os.path.basename(path)
+    try:
+        return calendar.timegm(time.strptime(name[len("history-"):-len(".seg")], _SEGMENT_FORMAT))
+    except ValueError:
+        return None
+
+
+def _to_le(column: array) -> bytes:
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _from_le(typecode: str, data) -> array:
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+class _Chunk:
+    """Column buffers plus the string tables they index into."""
+
+    def __init__(self) -> None:
+        self.columns: Dict[str, array] = {name: array(code) for name, code in COLUMNS}
+        self.tables: Dict[str, Dict[str, int]] = {name: {} for name in _STRING_COLUMNS}
+        self.min_observed = 0
+        self.max_observed = 0
+
+    def __len__(self) -> int:
+        return len(self.columns["observed_at"])
+
+    def append(self, arrivals: Iterable[Arrival], observed_at: int) -> None:
+        columns, tables = self.columns, self.tables
+        trips, routes, stops, directions = (tables[name] for name in _STRING_COLUMNS)
+        trip_col, route_col, stop_col, dir_col = (columns[name] for name in _STRING_COLUMNS)
+        predicted, observed = columns["predicted"], columns["observed_at"]
+        if not len(self):
+            self.min_observed = self.max_observed = observed_at
+        for arrival in arrivals:
+            observed.append(observed_at)
+            predicted.append(arrival.time)
+            trip_col.append(trips.setdefault(arrival.trip_id, len(trips)))
+            route_col.append(routes.setdefault(arrival.route, len(routes)))
+            stop_col.append(stops.setdefault(arrival.stop_id, len(stops)))
+            dir_col.append(directions.setdefault(arrival.direction, len(directions)))
+        self.min_observed = min(self.min_observed, observed_at)
+        self.max_observed = max(self.max_observed, observed_at)
+
+    def encode(self) -> bytes:
+        strings = marshal.dumps(tuple(tuple(self.tables[name]) for name in _STRING_COLUMNS))
+        header = _CHUNK.pack(MAGIC, len(self), self.min_observed, self.max_observed, len(strings))
+        return b"".join([header, strings] + [_to_le(self.columns[name]) for name, _ in COLUMNS])
+
+
+def _decode_rows(columns: Dict[str, array], tables: List[List[str]]) -> Iterator[Observation]:
+    trips, routes, stops, directions = tables
+    for observed, predicted, trip, route, stop, direction in zip(
+        *(columns[name] for name, _ in COLUMNS)
+    ):
+        yield Observation(observed, trips[trip], routes[route], stops[stop], directions[direction], predicted)
+
+
+def _chunk_size(rows: int, strings: int) -> int:
+    return _CHUNK.size + strings + rows * sum(array(code).itemsize for _, code in COLUMNS)
+
+
+def _valid_length(path: str) -> int:
+    """Bytes of ``path`` made of complete chunks (a crash can leave a partial one)."""
+    size = os.path.getsize(path)
+    offset = 0
+    with open(path, "rb") as handle:
+        while offset + _CHUNK.size <= size:
+            handle.seek(offset)
+            magic, rows, _, _, strings = _CHUNK.unpack(handle.read(_CHUNK.size))
+            end = offset + _chunk_size(rows, strings)
+            if magic != MAGIC or end > size:
+                break
+            offset = end
+    return offset
+
+
+def read_segment(path: str, start: int = 0, end: int = 2**32 - 1) -> Iterator[Observation]:
+    """Rows of one segment observed in [start, end); chunks outside it are skipped unread."""
+    with open(path, "rb") as handle:
+        if os.fstat(handle.fileno()).st_size == 0:
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            offset, size = 0, len(mapped)
+            while offset + _CHUNK.size <= size:
+                magic, rows, first, last, strings = _CHUNK.unpack_from(mapped, offset)
+                chunk_end = offset + _chunk_size(rows, strings)
+                if magic != MAGIC or chunk_end > size:
+                    break
+                if last >= start and first < end:
+                    position = offset + _CHUNK.size
+                    tables = [list(table) for table in marshal.loads(mapped[position:position + strings])]
+                    position += strings
+                    columns = {}
+                    for name, code in COLUMNS:
+                        width = rows * array(code).itemsize
+                        columns[name] = _from_le(code, mapped[position:position + width])
+                        position += width
+                    for row in _decode_rows(columns, tables):
+                        if start <= row.observed_at < end:
+                            yield row
+                offset = chunk_end
+
+
+class HistoryRecorder:
+    """Appends every observed arrival prediction to hourly columnar segments.
+
+    Rows are buffered per chunk (at most ``chunk_rows``) and appended to the
+    current segment when the buffer fills, the segment rotates, or the
+    recorder closes, so memory stays flat however long it runs.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_seconds: int = SEGMENT_SECONDS,
+        retain_days: float = RETAIN_DAYS,
+        chunk_rows: int = CHUNK_ROWS,
+    ) -> None:
+        self.directory = directory
+        self.segment_seconds = segment_seconds
+        self.retain_days = retain_days
+        self.chunk_rows = chunk_rows
+        self._segment: int | None = None
+        self._handle = None
+        self._chunk = _Chunk()
+        self._lock = threading.Lock()
+
+    def record(self, arrivals: Iterable[Arrival], observed_at: float) -> None:
+        observed = int(observed_at)
+        segment = observed - observed % self.segment_seconds
+        with self._lock:
+            if segment != self._segment:
+                self._rotate(segment)
+            self._chunk.append(arrivals, observed)
+            if len(self._chunk) >= self.chunk_rows:
+                self._flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush()
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush()
+            if self._handle is not None:
+                self._handle.close()
+                self._handle = None
+            self._segment = None
+
+    def query(self, start: float, end: float) -> Iterator[Observation]:
+        """Observations with ``start <= observed_at < end``, oldest segment first."""
+        self.flush()
+        yield from query(self.directory, start, end, self.segment_seconds)
+
+    def _flush(self) -> None:
+        if not len(self._chunk):
+            return
+        if self._handle is not None:
+            self._handle.write(self._chunk.encode())
+            self._handle.flush()
+        self._chunk = _Chunk()
+
+    def _rotate(self, segment: int) -> None:
+        self._flush()
+        if self._handle is not None:
+            self._handle.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, segment_name(segment))
+        if os.path.exists(path):
+            # Reopened after a restart: drop a chunk torn by a crash.
+            length = _valid_length(path)
+            if length != os.path.getsize(path):
+                os.truncate(path, length)
+        self._handle = open(path, "ab")
+        self._segment = segment
+        if self.retain_days > 0:
+            self._expire(segment - self.retain_days * 86400)
+
+    def _expire(self, cutoff: float) -> None:
+        for path in glob.glob(os.path.join(self.directory, "history-*.seg")):
+            start = segment_start(path)
+            if start is not None and start + self.segment_seconds <= cutoff:
+                try:
+                    os.unlink(path)
+                except OSError as exc:
+                    log.warning("could not remove %s: %s", path, exc)
+
+
+def query(
+    directory: str,
+    start: float,
+    end: float,
+    segment_seconds: int = SEGMENT_SECONDS,
+) -> Iterator[Observation]:
+    """Observations recorded in ``directory`` with ``start <= observed_at < end``."""
+    segments: List[Tuple[int, str]] = []
+    for path in glob.glob(os.path.join(directory, "history-*.seg")):
+        segment = segment_start(path)
+        if segment is not None and segment < end and segment + segment_seconds > start:
+            segments.append((segment, path))
+    for _, path in sorted(segments):
+        yield from read_segment(path, math.floor(start), math.ceil(end))
+
+
+def matches_stop(row: Observation, stop: str) -> bool:
+    """Whether ``stop`` (a GTFS stop_id, with or without its N/S suffix) names ``row``'s stop."""
+    # Recorded directions are the N/S flags StopIndex splits off the stop_id.
+    return stop in (row.stop_id, row.stop_id + row.direction)
+
+
+def _parse_time(value: str) -> float:
+    try:
+        return float(value)
+    except ValueError:
+        parsed = dt.datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.astimezone()
+        return parsed.timestamp()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export recorded arrival predictions as CSV.")
+    parser.add_argument("--dir", default=HISTORY_DIR or "history", help="recorder directory (HISTORY_DIR)")
+    parser.add_argument("--start", default="0", help="epoch seconds or ISO time (local if no offset)")
+    parser.add_argument("--end", default="", help="epoch seconds or ISO time; default now")
+    parser.add_argument("--route", default="")
+    parser.add_argument("--stop", default="", help="GTFS stop_id, with or without the N/S suffix")
+    args = parser.parse_args()
+
+    start = _parse_time(args.start)
+    end = _parse_time(args.end) if args.end else time.time()
+    writer = csv.writer(sys.stdout)
+    writer.writerow(Observation._fields)
+    for row in query(args.dir, start, end):
+        if args.route and row.route != args.route:
+            continue
+        if args.stop and not matches_stop(row, args.stop):
+            continue
+        writer.writerow(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+if ("serviceWorker" in navigator) {
+  window.addEventListener("load", () => {
+    navigator.serviceWorker.register("/sw.js");
+  });
+}
+const refreshButton = document.querySelector(".refresh");
+const themeButton = document.querySelector(".theme-toggle");
+const storedTheme = localStorage.getItem("theme");
+const initialTheme = storedTheme || "light";
+document.body.setAttribute("data-theme", initialTheme);
+if (themeButton) {
+  themeButton.setAttribute("aria-pressed", initialTheme === "dark" ? "true" : "false");
+  themeButton.textContent = initialTheme === "dark" ? "Light" : "Dark";
+}
+if (themeButton) {
+  themeButton.addEventListener("click", () => {
+    const current = document.body.getAttribute("data-theme");
+    const next = current === "dark" ? "light" : "dark";
+    document.body.setAttribute("data-theme", next);
+    localStorage.setItem("theme", next);
+    themeButton.setAttribute("aria-pressed", next === "dark" ? "true" : "false");
+    themeButton.textContent = next === "dark" ? "Light" : "Dark";
+  });
+}
+const triggerRefresh = () => {
+  if (refreshButton) refreshButton.classList.add("spin");
+  window.location.reload();
+};
+if (refreshButton) {
+  refreshButton.addEventListener("click", triggerRefresh);
+}
+const toggleSection = (section) => {
+  const button = section.querySelector(".more-toggle");
+  const list = section.querySelector(".more-list");
+  if (!button || !list) return;
+  const isOpen = section.classList.toggle("open");
+  button.setAttribute("aria-expanded", String(isOpen));
+  if (isOpen) {
+    list.style.maxHeight = list.scrollHeight + "px";
+  } else {
+    list.style.maxHeight = "0px";
+  }
+};
+// Delegated so cards patched in by live updates need no rebinding.
+document.addEventListener("click", (event) => {
+  const card = event.target.closest(".card");
+  if (!card) return;
+  const section = card.querySelector(".more");
+  if (section) toggleSection(section);
+});
+const main = document.querySelector("main");
+const asof = document.querySelector(".asof");
+const zone = "America/New_York";
+const clock = new Intl.DateTimeFormat("en-US", { timeZone: zone, hour: "2-digit", minute: "2-digit", hourCycle: "h23" });
+const stamp = new Intl.DateTimeFormat("en-US", { timeZone: zone, weekday: "short", month: "short", day: "2-digit", hour: "2-digit", minute: "2-digit", hourCycle: "h23" });
+const escapeHtml = (text) => String(text).replace(/[&<>"]/g, (c) => ({ "&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;" })[c]);
+const fmtTime = (ts, nowSec) => clock.format(new Date(ts * 1000)) + " · " + Math.max(0, Math.floor((ts - nowSec) / 60)) + "m";
+const fmtStamp = (date) => {
+  const p = {};
+  stamp.formatToParts(date).forEach((part) => { p[part.type] = part.value; });
+  return "As of " + p.weekday + " " + p.month + " " + p.day + " " + p.hour + ":" + p.minute + " ET";
+};
+const byRow = (a, b) => (a.s < b.s ? -1 : a.s > b.s ? 1 : a.r < b.r ? -1 : a.r > b.r ? 1 : a.d < b.d ? -1 : a.d > b.d ? 1 : 0);
+const rows = new Map();
+const cards = new Map();
+document.querySelectorAll(".card").forEach((card) => cards.set(card.dataset.key, card));
+const renderCard = (card, row) => {
+  const nowSec = Date.now() / 1000;
+  const times = row.t.filter((ts) => ts > nowSec);
+  const wasOpen = card.querySelector(".more.open") !== null;
+  const extra = times.slice(2).map((ts) => "<li>" + escapeHtml(fmtTime(ts, nowSec)) + "</li>").join("");
+  card.dataset.key = row.k;
+  card.innerHTML =
+    '<div class="badge" style="background:' + escapeHtml(row.c) + '">' + escapeHtml(row.r) + "</div>" +
+    '<div class="meta"><div class="stop">' + escapeHtml(row.s) + ' <span class="dir">' + escapeHtml(row.d) + "</span></div></div>" +
+    '<div class="times"><div class="time">' + (times.length > 0 ? escapeHtml(fmtTime(times[0], nowSec)) : "--:--") + "</div>" +
+    '<div class="time muted">' + (times.length > 1 ? escapeHtml(fmtTime(times[1], nowSec)) : "--:--") + "</div></div>" +
+    (extra ? '<div class="more"><button class="more-toggle" type="button" aria-expanded="false">More trains</button><ul class="more-list">' + extra + "</ul></div>" : "");
+  if (wasOpen) {
+    const section = card.querySelector(".more");
+    if (section) toggleSection(section);
+  }
+};
+// Patch only the cards whose rows changed (all of them when keys is null).
+const sync = (keys) => {
+  cards.forEach((card, key) => {
+    if (!rows.has(key)) {
+      card.remove();
+      cards.delete(key);
+    }
+  });
+  rows.forEach((row, key) => {
+    let card = cards.get(key);
+    const isNew = !card;
+    if (isNew) {
+      card = document.createElement("article");
+      card.className = "card";
+      cards.set(key, card);
+    }
+    if (isNew || !keys || keys.has(key)) renderCard(card, row);
+  });
+  const order = [...rows.values()].sort(byRow).map((row) => row.k);
+  const current = [...main.querySelectorAll(".card")].map((card) => card.dataset.key);
+  if (order.length !== current.length || order.some((key, i) => key !== current[i])) {
+    order.forEach((key) => main.appendChild(cards.get(key)));
+  }
+  const empty = main.querySelector(".empty");
+  if (rows.size && empty) empty.remove();
+  if (!rows.size && !empty) main.insertAdjacentHTML("beforeend", '<div class="empty">No arrivals found.</div>');
+};
+// "As of" is when the server built the data, so a stalled stream shows its age.
+const stampData = (data) => {
+  if (asof && data.now) asof.textContent = fmtStamp(new Date(data.now * 1000));
+};
+if (window.EventSource) {
+  const eventsUrl = location.pathname.replace(/\/(mobile)?$/, "") + "/events" + location.search;
+  const source = new EventSource(eventsUrl);
+  source.addEventListener("snapshot", (event) => {
+    const data = JSON.parse(event.data);
+    rows.clear();
+    data.rows.forEach((row) => rows.set(row.k, row));
+    sync(null);
+    stampData(data);
+  });
+  source.addEventListener("delta", (event) => {
+    const data = JSON.parse(event.data);
+    data.set.forEach((row) => rows.set(row.k, row));
+    data.del.forEach((key) => rows.delete(key));
+    sync(new Set(data.set.map((row) => row.k)));
+    stampData(data);
+  });
+  // Network drops reconnect on their own, but a refused stream (e.g. 503 when
+  // the server is at MAX_STREAMS) closes for good: fall back to reloading.
+  source.onerror = () => {
+    if (source.readyState !== EventSource.CLOSED) return;
+    setTimeout(triggerRefresh, 30000);
+  };
+  // Countdowns tick locally; the server only pushes when data changes.
+  setInterval(() => sync(null), 15000);
+} else {
+  setInterval(triggerRefresh, 30000);
+}
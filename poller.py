@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from functools import partial
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
+
+import metrics
+from extract import Arrival, StopIndex, extract_arrivals
+from feeds import FeedFetcher, FeedStatus, FetchResult, body_digest, feed_name
+from history import HistoryRecorder
+from profiler import profiled
+from schedule_index import EMPTY_STOP_TIMES, DiffStats, ScheduleIndex, StopTimes, schedule_rows
+from snapshot_cache import RESTORED, SnapshotCache
+from timetable_svg import ET_TZ, MY_STOPS, ScheduleRow, plan_feed_urls
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = float(os.getenv("POLL_INTERVAL", "30"))
+
+APPLY_SECONDS = metrics.histogram(
+    "mta_schedule_apply_seconds", "Time to apply a feed version to the schedule index.", ("feed",)
+)
+BUILD_SECONDS = metrics.histogram("mta_schedule_build_seconds", "Time to build schedule rows for a view.")
+
+
+@dataclass(frozen=True)
+class FeedState:
+    url: str
+    arrivals: Tuple[Arrival, ...]
+    fetched_at: float
+    error: str | None = None
+    diff: DiffStats = DiffStats()
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    version: int
+    feeds: Mapping[str, FeedState]
+    updated_at: float
+    stop_map: Mapping[str, str]
+    # Sorted upcoming times per stop, shared by every board.
+    stops: StopTimes
+
+    def schedule(
+        self,
+        stop_map: Dict[str, str] | None = None,
+        limit: int | None = None,
+        now: dt.datetime | None = None,
+    ) -> Tuple[List[ScheduleRow], dt.datetime]:
+        # stop_map may be any subset of the polled stops (one board); stops
+        # the poller doesn't watch have no arrivals in the snapshot.
+        now = now or dt.datetime.now(ET_TZ)
+        stop_map = stop_map or self.stop_map
+        with BUILD_SECONDS.time():
+            rows = schedule_rows(self.stops, stop_map, now, limit=limit)
+        return rows, now
+
+
+class FeedPoller:
+    """Refreshes each feed on its own thread and publishes immutable snapshots.
+
+    Readers call ``snapshot`` (or ``current``) and never touch the network; a
+    feed that fails to refresh keeps its last good arrivals in the snapshot
+    until they are older than the fetcher's ``max_stale``.
+    Only arrivals at the stops in ``stop_map`` are decoded and kept.
+
+    With a ``cache``, the last good feeds are restored on ``start`` (so the
+    first snapshot is ready before any fetch, flagged as restored) and saved
+    again as new data arrives. A ``recorder`` gets every new feed version's
+    arrivals for later analysis.
+    """
+
+    def __init__(
+        self,
+        urls: List[str] | None = None,
+        interval: float = DEFAULT_INTERVAL,
+        intervals: Dict[str, float] | None = None,
+        stop_map: Dict[str, str] | None = None,
+        fetcher: FeedFetcher | None = None,
+        cache: SnapshotCache | None = None,
+        recorder: HistoryRecorder | None = None,
+    ) -> None:
+        self.stop_index = StopIndex(stop_map or MY_STOPS)
+        self.fetcher = fetcher or FeedFetcher(decode=partial(self._decode, self.stop_index))
+        self.urls = list(urls or plan_feed_urls(self.stop_index.stop_map))
+        self.interval = interval
+        self.intervals = dict(intervals or {})
+        self.index = ScheduleIndex()
+        self.cache = cache
+        self.recorder = recorder
+        self._restored = False
+        self._snapshot = Snapshot(
+            version=0,
+            feeds=MappingProxyType({}),
+            updated_at=0.0,
+            stop_map=MappingProxyType(self.stop_index.stop_map),
+            stops=EMPTY_STOP_TIMES,
+        )
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._stopping = threading.Event()
+        self._ready = threading.Event()
+        self._pending = set(self.urls)
+        self._threads: List[threading.Thread] = []
+
+    @property
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    def current(self, timeout: float | None = None) -> Snapshot:
+        # Only blocks until every feed has been tried once (on cold start).
+        self._ready.wait(timeout)
+        return self._snapshot
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def wait_for_change(self, version: int, timeout: float | None = None) -> Snapshot:
+        """Block until the snapshot version differs from ``version`` (or timeout/stop)."""
+        with self._changed:
+            self._changed.wait_for(
+                lambda: self._snapshot.version != version or self._stopping.is_set(),
+                timeout,
+            )
+            return self._snapshot
+
+    def feed_status(self, url: str) -> FeedStatus:
+        return self.fetcher.status(url)
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stopping.clear()
+        if self.cache is not None:
+            if not self._restored:
+                self._restored = True
+                self.restore()
+            self.cache.start()
+        for url in self.urls:
+            thread = threading.Thread(
+                target=self._run, args=(url,), name=f"poller-{url[-12:]}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        self._stopping.set()
+        with self._changed:
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        if self.cache is not None:
+            self.cache.stop(timeout)
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def restore(self) -> int:
+        """Publish the cached feeds, returning how many were restored."""
+        if self.cache is None:
+            return 0
+        stop_map = self.stop_index.stop_map
+        # The fetcher stops serving a copy older than max_stale at its first
+        # failed fetch, so an older one would vanish in the outage it covers.
+        oldest = time.time() - self.fetcher.max_stale
+        restored = 0
+        for url, cached in self.cache.load(stop_map).items():
+            if url not in self.urls or cached.fetched_at < oldest:
+                continue
+            arrivals, digest = cached.arrivals, cached.digest
+            if arrivals is None:
+                # Cached for other stops: re-decode the raw body for ours.
+                body = self.cache.read_body(url)
+                if body is None:
+                    continue
+                arrivals, digest = self._decode(self.stop_index, body), body_digest(body)
+            self.fetcher.seed(url, arrivals, digest, cached.fetched_at, error=RESTORED)
+            self.cache.record(FetchResult(url, arrivals, digest, False, cached.fetched_at), stop_map)
+            self._publish(url, FeedState(url, arrivals, cached.fetched_at, error=RESTORED), apply=True)
+            restored += 1
+        if restored:
+            log.info("restored %d feeds from %s", restored, self.cache.directory)
+        return restored
+
+    def refresh(self, url: str) -> Snapshot:
+        previous = self._snapshot.feeds.get(url)
+        try:
+            result = self.fetcher.fetch(url)
+        except Exception as exc:
+            # Nothing recent enough to fall back on: drop the feed's arrivals
+            # rather than keep showing predictions from a dead feed.
+            log.warning("feed refresh failed for %s: %s", url, exc)
+            if previous is not None and previous.error and not previous.arrivals:
+                return self._mark_done(url)
+            state = FeedState(url, (), previous.fetched_at if previous else 0.0, error=str(exc))
+            return self._publish(url, state, apply=True)
+        if result.error:
+            log.warning("serving stale %s: %s", url, result.error)
+        if not result.changed and previous is not None and previous.error == result.error:
+            # Same bytes as last time: keep the snapshot (and its version).
+            return self._mark_done(url)
+        if self.cache is not None and not result.error:
+            self.cache.record(result, self.stop_index.stop_map)
+        if self.recorder is not None and result.changed:
+            try:
+                self.recorder.record(result.decoded, result.fetched_at)
+            except OSError as exc:
+                log.warning("history write failed: %s", exc)
+        state = FeedState(url, result.decoded, result.fetched_at, error=result.error)
+        return self._publish(url, state, apply=True)
+
+    def _publish(self, url: str, state: FeedState, apply: bool = False) -> Snapshot:
+        with self._lock:
+            now = time.time()
+            if apply:
+                # Only trips that changed since this feed's last version
+                # touch the index.
+                with APPLY_SECONDS.time(feed=feed_name(url)):
+                    diff = self.index.apply(url, state.arrivals, now=now)
+                state = replace(state, diff=diff)
+            else:
+                self.index.evict(now)
+            feeds = dict(self._snapshot.feeds)
+            feeds[url] = state
+            self._snapshot = Snapshot(
+                version=self._snapshot.version + 1,
+                feeds=MappingProxyType(feeds),
+                updated_at=now,
+                stop_map=self._snapshot.stop_map,
+                stops=self.index.view(),
+            )
+            self._changed.notify_all()
+        return self._mark_done(url)
+
+    def _mark_done(self, url: str) -> Snapshot:
+        with self._lock:
+            self._pending.discard(url)
+            if not self._pending:
+                self._ready.set()
+            return self._snapshot
+
+    @staticmethod
+    def _decode(index: StopIndex, payload: bytes) -> Tuple[Arrival, ...]:
+        return tuple(extract_arrivals(payload, index))
+
+    def _run(self, url: str) -> None:
+        interval = self.intervals.get(url, self.interval)
+        while not self._stopping.is_set():
+            with profiled("feed"):
+                self.refresh(url)
+            # A failing feed backs off past the poll interval (with jitter).
+            self._stopping.wait(max(interval, self.fetcher.retry_in(url)))
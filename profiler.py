@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+log = logging.getLogger(__name__)
+
+# The profiling endpoint is disabled unless a token is configured.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp")
+MAX_SECONDS = 60.0
+SAMPLE_INTERVAL = 0.005
+
+# Leaf frames of threads that are parked waiting for work.
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("socketserver.py", "serve_forever"),
+}
+
+_busy = threading.Lock()
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(
+    seconds: float,
+    interval: float = SAMPLE_INTERVAL,
+    include_idle: bool = False,
+) -> Counter:
+    """Wall-clock samples of every other thread's stack, as collapsed stacks.
+
+    Keys are "thread;outer;...;inner" strings (the format flame graph tools
+    read); values are sample counts.
+    """
+    own = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + min(seconds, MAX_SECONDS)
+    while time.monotonic() < deadline:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            code = frame.f_code
+            if not include_idle and (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, str(ident)))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(interval)
+    return counts
+
+
+def format_collapsed(counts: Counter) -> bytes:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common()).encode("utf-8")
+
+
+class ProfileSession:
+    """Collects cProfile data from ``profiled`` blocks until enough requests ran."""
+
+    def __init__(self, requests: int | None = None) -> None:
+        self.remaining = requests
+        self.stats: pstats.Stats | None = None
+        self.calls: Dict[str, int] = Counter()
+        self.done = threading.Event()
+        self._lock = threading.Lock()
+
+    def add(self, profile: cProfile.Profile, kind: str) -> None:
+        with self._lock:
+            if self.done.is_set():
+                return
+            if self.stats is None:
+                self.stats = pstats.Stats(profile)
+            else:
+                self.stats.add(profile)
+            self.calls[kind] += 1
+            if kind == "request" and self.remaining is not None:
+                self.remaining -= 1
+                if self.remaining <= 0:
+                    self.done.set()
+
+    def finish(self) -> pstats.Stats | None:
+        with self._lock:
+            self.done.set()
+            return self.stats
+
+
+_session: ProfileSession | None = None
+
+
+@contextmanager
+def profiled(kind: str) -> Iterator[None]:
+    """Profile the block if a cProfile session is running; otherwise free."""
+    session = _session
+    if session is None or session.done.is_set():
+        yield
+        return
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        # Python 3.12+ allows one active cProfile per process, so calls that
+        # overlap one already being profiled go unrecorded.
+        profile = None
+    if profile is None:
+        yield
+        return
+    try:
+        yield
+    finally:
+        profile.disable()
+        session.add(profile, kind)
+
+
+def run_cprofile(seconds: float, requests: int | None = None) -> pstats.Stats | None:
+    """Profile request handling and feed refreshes for ``seconds`` or ``requests``."""
+    global _session
+    session = ProfileSession(requests)
+    _session = session
+    try:
+        session.done.wait(min(seconds, MAX_SECONDS))
+    finally:
+        _session = None
+    return session.finish()
+
+
+def format_pstats(stats: pstats.Stats | None, text: bool = False, limit: int = 60) -> bytes:
+    if stats is None:
+        return b"no calls were profiled\n" if text else marshal.dumps({})
+    if not text:
+        # Same bytes as Stats.dump_stats(); load with pstats.Stats(path).
+        return marshal.dumps(stats.stats)
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats("cumulative").print_stats(limit)
+    return out.getvalue().encode("utf-8")
+
+
+@contextmanager
+def exclusive() -> Iterator[bool]:
+    # One profile at a time; a second caller gets False instead of waiting.
+    acquired = _busy.acquire(blocking=False)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            _busy.release()
+
+
+def dump_on_signal(seconds: float = 30.0) -> None:
+    """Sample all threads for ``seconds`` in the background and write the stacks to PROFILE_DIR."""
+
+    def run() -> None:
+        with exclusive() as acquired:
+            if not acquired:
+                log.warning("profile already running; ignoring signal")
+                return
+            counts = sample_stacks(seconds)
+        path = os.path.join(PROFILE_DIR, f"profile-{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}.collapsed")
+        with open(path, "wb") as handle:
+            handle.write(format_collapsed(counts))
+        log.warning("wrote %s (%d samples)", path, sum(counts.values()))
+
+    threading.Thread(target=run, name="profiler", daemon=True).start()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import datetime as dt
+import hashlib
+import io
+import logging
+import marshal
+import os
+import re
+import struct
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Hashable, List, Tuple
+
+try:
+    from PIL import Image, ImageChops, ImageDraw, ImageFont
+except ImportError:  # optional; raster endpoints answer 501 without Pillow
+    Image = None
+
+from render_cache import CACHE_REQUESTS, RENDER_SECONDS
+from timetable_svg import (
+    SVG_BG as BG,
+    SVG_COL_DIR as COL_DIR,
+    SVG_COL_LINE as COL_LINE,
+    SVG_COL_NEXT as COL_NEXT,
+    SVG_COL_STOP as COL_STOP,
+    SVG_FG as FG,
+    SVG_HEADER as HEADER,
+    SVG_HEADER_H as HEADER_H,
+    SVG_HEIGHT as HEIGHT,
+    SVG_MARGIN as MARGIN,
+    SVG_MUTED as MUTED,
+    SVG_TABLE_H as TABLE_H,
+    SVG_TABLE_Y as TABLE_Y,
+    SVG_WIDTH as WIDTH,
+    ScheduleRow,
+    format_arrival,
+    route_color,
+)
+
+FONT_PATH = os.getenv("RASTER_FONT", "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf")
+BOLD_FONT_PATH = os.getenv("RASTER_FONT_BOLD", "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf")
+
+log = logging.getLogger(__name__)
+
+SUPPORTED_BITS = (1, 4)
+
+# Packed pixels: rows top to bottom, each padded to a whole byte, MSB first.
+# 1-bit: 0 = black, 1 = white. 4-bit: 0 (black) .. 15 (white), two per byte.
+#
+# Diff layout (little-endian): magic "MTAD", u8 bits, u16 width, u16 height,
+# u16 rect count, then per rect: u16 x, y, w, h and the rect's packed pixels.
+# x and w are multiples of 8, so every rect packs on byte boundaries.
+DIFF_MAGIC = b"MTAD"
+ALIGN = 8
+
+# 4-bit frames are palette images whose 16 levels map to evenly spaced grays.
+_LEVELS_PALETTE = [c * 17 for c in range(16) for _ in range(3)]
+# Frame ids are 8-byte blake2b digests; anything else never names a shared frame.
+_FRAME_ID = re.compile(r"[0-9a-f]{16}")
+
+Rect = Tuple[int, int, int, int]
+
+
+def available() -> bool:
+    return Image is not None
+
+
+@lru_cache(maxsize=32)
+def _font(size: int, bold: bool = False):
+    try:
+        return ImageFont.truetype(BOLD_FONT_PATH if bold else FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+def _gray(color: str) -> int:
+    r, g, b = (int(color[i:i + 2], 16) for i in (1, 3, 5))
+    return round(0.299 * r + 0.587 * g + 0.114 * b)
+
+
+def _quantize(image, bits: int):
+    if bits == 1:
+        return image.point(lambda v: 255 if v >= 128 else 0).convert("1", dither=Image.Dither.NONE)
+    levels = Image.frombytes("P", image.size, image.point(lambda v: v >> 4).tobytes())
+    levels.putpalette(_LEVELS_PALETTE)
+    return levels
+
+
+def _pack(image, bits: int) -> bytes:
+    return image.tobytes() if bits == 1 else image.tobytes("raw", "P;4")
+
+
+def _unpack(packed: bytes, bits: int):
+    if bits == 1:
+        return Image.frombytes("1", (WIDTH, HEIGHT), packed)
+    levels = Image.frombytes("P", (WIDTH, HEIGHT), packed, "raw", "P;4")
+    levels.putpalette(_LEVELS_PALETTE)
+    return levels
+
+
+def _align(rect: Rect) -> Rect:
+    x0, y0, x1, y1 = rect
+    return x0 - x0 % ALIGN, y0, min(WIDTH, x1 + (-x1) % ALIGN), y1
+
+
+@dataclass(frozen=True)
+class Frame:
+    frame_id: str
+    bits: int
+    layout: Hashable
+    image: object
+    packed: bytes
+    cells: Tuple[Rect, ...]
+
+    def png(self) -> bytes:
+        out = io.BytesIO()
+        if self.bits == 1:
+            self.image.save(out, "PNG", optimize=True)
+        else:
+            self.image.save(out, "PNG", optimize=True, bits=4)
+        return out.getvalue()
+
+
+class RasterRenderer:
+    """Grayscale bitmaps of the timetable for e-ink panels.
+
+    The static layer (background, title, badges, stop and direction labels)
+    is cached per row layout; each frame only draws the clock and arrival
+    cells on a copy. Recent frames are kept so panels can ask for the
+    rectangles that changed since the frame they are showing.
+
+    With ``frame_dir`` set, recent frames are also written there so renderers
+    in other processes (pre-fork workers) can diff against them.
+    """
+
+    def __init__(self, max_frames: int = 32, max_layers: int = 16, frame_dir: str | None = None) -> None:
+        self.max_frames = max_frames
+        self.max_layers = max_layers
+        self.frame_dir = frame_dir
+        self._frames: "OrderedDict[Hashable, Frame]" = OrderedDict()
+        self._by_id: "OrderedDict[str, Frame]" = OrderedDict()
+        self._layers: "OrderedDict[Hashable, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def render(
+        self,
+        key: Hashable,
+        build_rows: Callable[[], List[ScheduleRow]],
+        now: dt.datetime,
+        bits: int,
+    ) -> Frame:
+        key = (key, bits)
+        with self._lock:
+            frame = self._frames.get(key)
+            if frame is not None:
+                self._frames.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="raster", result="hit")
+                return frame
+        CACHE_REQUESTS.inc(cache="raster", result="miss")
+
+        rows = build_rows()
+        started = time.perf_counter()
+        layout = tuple((row.route, row.stop_name, row.direction) for row in rows)
+        row_h = min(78, int(TABLE_H / max(len(rows), 1)))
+        image = self._static_layer(layout, row_h, bits).copy()
+        draw = ImageDraw.Draw(image)
+        clock = f"As of {now.strftime('%a %b %d %H:%M')} ET"
+        draw.text((WIDTH - MARGIN, MARGIN + 42), clock, fill=self._ink(MUTED, bits), font=_font(20), anchor="rs")
+        cells = [(WIDTH // 2, MARGIN, WIDTH, MARGIN + HEADER_H)]
+        time_font = _font(30, bold=True)
+        for i, row in enumerate(rows):
+            baseline = TABLE_Y + (i + 1) * row_h - row_h / 2 + 6
+            for col, ts in ((COL_DIR, row.times[0:1]), (COL_NEXT, row.times[1:2])):
+                text = format_arrival(ts[0], now) if ts else "--:--"
+                draw.text((col, baseline), text, fill=self._ink(FG, bits), font=time_font, anchor="ls")
+            cells.append(_align((COL_DIR, TABLE_Y + i * row_h, WIDTH, TABLE_Y + (i + 1) * row_h)))
+
+        quantized = _quantize(image, bits)
+        packed = _pack(quantized, bits)
+        frame_id = hashlib.blake2b(packed, digest_size=8, person=bytes([bits])).hexdigest()
+        frame = Frame(frame_id, bits, (layout, row_h), quantized, packed, tuple(cells))
+        RENDER_SECONDS.observe(time.perf_counter() - started, endpoint=f"raster{bits}")
+        with self._lock:
+            self._frames[key] = frame
+            self._by_id[frame_id] = frame
+            self._by_id.move_to_end(frame_id)
+            while len(self._frames) > self.max_frames:
+                self._frames.popitem(last=False)
+            while len(self._by_id) > self.max_frames:
+                self._by_id.popitem(last=False)
+        if self.frame_dir:
+            try:
+                self._share(frame)
+            except OSError as exc:
+                log.warning("could not share raster frame in %s: %s", self.frame_dir, exc)
+        return frame
+
+    def diff(self, since: str, frame: Frame) -> bytes:
+        """Changed rectangles from frame ``since`` to ``frame``; one full rect if unknown."""
+        with self._lock:
+            base = self._by_id.get(since)
+        if base is None and self.frame_dir:
+            base = self._shared(since)
+        if base is None or base.bits != frame.bits or base.layout != frame.layout:
+            rects = [(0, 0, WIDTH, HEIGHT)]
+        elif base.frame_id == frame.frame_id:
+            rects = []
+        else:
+            rects = []
+            for cell in frame.cells:
+                box = ImageChops.difference(
+                    base.image.crop(cell).convert("L"), frame.image.crop(cell).convert("L")
+                ).getbbox()
+                if box is not None:
+                    x0, y0, x1, y1 = box
+                    rects.append(_align((cell[0] + x0, cell[1] + y0, cell[0] + x1, cell[1] + y1)))
+
+        out = bytearray(DIFF_MAGIC)
+        out += struct.pack("<BHHH", frame.bits, WIDTH, HEIGHT, len(rects))
+        for x0, y0, x1, y1 in rects:
+            out += struct.pack("<HHHH", x0, y0, x1 - x0, y1 - y0)
+            out += _pack(frame.image.crop((x0, y0, x1, y1)), frame.bits)
+        return bytes(out)
+
+    def _frame_path(self, frame_id: str) -> str:
+        return os.path.join(self.frame_dir, f"{frame_id}.frame")
+
+    def _share(self, frame: Frame) -> None:
+        path = self._frame_path(frame.frame_id)
+        if os.path.exists(path):
+            # Ids are content hashes, so another worker already wrote this frame.
+            os.utime(path)
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as handle:
+            marshal.dump((frame.bits, frame.layout, frame.packed, frame.cells), handle)
+        os.replace(tmp_path, path)
+        shared = sorted(
+            (entry.stat().st_mtime_ns, entry.path)
+            for entry in os.scandir(self.frame_dir)
+            if entry.name.endswith(".frame")
+        )
+        for _, old_path in shared[:-self.max_frames]:
+            try:
+                os.unlink(old_path)
+            except FileNotFoundError:
+                pass
+
+    def _shared(self, frame_id: str) -> Frame | None:
+        if not _FRAME_ID.fullmatch(frame_id):
+            return None
+        try:
+            with open(self._frame_path(frame_id), "rb") as handle:
+                bits, layout, packed, cells = marshal.load(handle)
+            frame = Frame(frame_id, bits, layout, _unpack(packed, bits), packed, cells)
+        except (OSError, ValueError, EOFError, TypeError):
+            return None
+        with self._lock:
+            self._by_id[frame_id] = frame
+            while len(self._by_id) > self.max_frames:
+                self._by_id.popitem(last=False)
+        return frame
+
+    def _ink(self, color: str, bits: int) -> int:
+        value = _gray(color)
+        return (255 if value >= 128 else 0) if bits == 1 else value
+
+    def _static_layer(self, layout: Tuple[Tuple[str, str, str], ...], row_h: int, bits: int):
+        key = (layout, row_h, bits)
+        with self._lock:
+            layer = self._layers.get(key)
+            if layer is not None:
+                self._layers.move_to_end(key)
+                return layer
+
+        layer = Image.new("L", (WIDTH, HEIGHT), self._ink(BG, bits))
+        draw = ImageDraw.Draw(layer)
+        draw.text((MARGIN, MARGIN + 42), "MTA ARRIVALS", fill=self._ink(HEADER, bits), font=_font(58, bold=True), anchor="ls")
+        for i, (route, stop_name, direction) in enumerate(layout):
+            middle = TABLE_Y + (i + 1) * row_h - row_h / 2
+            cx = MARGIN + 30
+            badge = _gray(route_color(route))
+            if bits == 1:
+                # Route colors don't survive thresholding; draw every badge solid.
+                badge_fill, label_fill = 0, 255
+            else:
+                badge_fill, label_fill = badge, (0 if badge >= 160 else 255)
+            draw.ellipse((cx - 30, middle - 30, cx + 30, middle + 30), fill=badge_fill)
+            draw.text((cx, middle + 10), route, fill=label_fill, font=_font(30, bold=True), anchor="ms")
+            draw.text((COL_LINE, middle + 6), stop_name, fill=self._ink(FG, bits), font=_font(28), anchor="ls")
+            draw.text((COL_STOP, middle + 6), direction, fill=self._ink(MUTED, bits), font=_font(20), anchor="ls")
+
+        with self._lock:
+            self._layers[key] = layer
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+        return layer
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Hashable, Iterable
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+
+CACHE_REQUESTS = metrics.counter(
+    "mta_render_cache_requests_total", "Render cache lookups.", ("cache", "result")
+)
+RENDER_SECONDS = metrics.histogram(
+    "mta_render_seconds", "Time to render a response body on a cache miss.", ("endpoint",)
+)
+
+# Bodies smaller than this are sent as-is; compression wouldn't pay for itself.
+MIN_COMPRESS_SIZE = 256
+
+
+@dataclass(frozen=True)
+class Rendered:
+    body: bytes
+    encodings: Dict[str, bytes]
+    digest: str
+
+    def etag(self, encoding: str | None = None) -> str:
+        # Each encoding is a distinct representation, so it gets its own tag.
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def negotiate(self, accept_encoding: str | None) -> str | None:
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ("br", "gzip"):
+            # "*" only covers codings the client didn't list, so "gzip;q=0, *" refuses gzip.
+            if encoding in self.encodings and accepted.get(encoding, accepted.get("*", 0.0)) > 0:
+                return encoding
+        return None
+
+
+def parse_accept_encoding(header: str | None) -> Dict[str, float]:
+    """Coding -> qvalue; refused codings are kept with q=0."""
+    accepted: Dict[str, float] = {}
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def etag_matches(if_none_match: str | None, etags: Iterable[str]) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return any(tag in wanted for tag in etags)
+
+
+def encode_payload(body: bytes, compress: bool = True) -> Rendered:
+    encodings = {}
+    if compress and len(body) >= MIN_COMPRESS_SIZE:
+        encodings["gzip"] = gzip.compress(body, compresslevel=6, mtime=0)
+        if brotli is not None:
+            encodings["br"] = brotli.compress(body, quality=5)
+    digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+    return Rendered(body, encodings, digest)
+
+
+class RenderCache:
+    """Small LRU of pre-encoded responses.
+
+    Keys are whatever uniquely determines the output, e.g. (name, snapshot
+    version, view_key(rows, now)); old views and versions simply age out.
+    """
+
+    def __init__(self, max_entries: int = 64, name: str = "render") -> None:
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: "OrderedDict[Hashable, Rendered]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_render(
+        self,
+        key: Hashable,
+        render: Callable[[], bytes],
+        compress: bool = True,
+    ) -> Rendered:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                CACHE_REQUESTS.inc(cache=self.name, result="hit")
+                return entry
+        CACHE_REQUESTS.inc(cache=self.name, result="miss")
+        # Render outside the lock; two racing misses just do the work twice.
+        entry = encode_payload(render(), compress=compress)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
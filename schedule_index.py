@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import bisect
+import datetime as dt
+import heapq
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+from extract import DIRECTIONS, Arrival
+from timetable_svg import ScheduleRow
+
+# (stop_id, route, direction code)
+GroupKey = Tuple[str, str, str]
+# stop_id -> (route, direction code) -> sorted epoch times
+StopTimes = Mapping[str, Mapping[Tuple[str, str], Tuple[int, ...]]]
+
+EMPTY_STOP_TIMES: StopTimes = MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class DiffStats:
+    inserted: int = 0
+    updated: int = 0
+    removed: int = 0
+    evicted: int = 0
+
+
+class ScheduleIndex:
+    """Sorted arrivals per (stop, route, direction), maintained by trip diffs.
+
+    Each feed version is compared trip by trip with the previous one from the
+    same source, so only inserted, changed or vanished trips touch the sorted
+    lists. Past arrivals are evicted through a min-heap on arrival time. Not
+    thread-safe; callers serialize ``apply``/``evict``/``view``.
+    """
+
+    def __init__(self) -> None:
+        self._trips: Dict[str, Dict[str, Tuple[Arrival, ...]]] = {}
+        self._groups: Dict[GroupKey, List[Tuple[int, str]]] = {}
+        # Lazy: entries for arrivals already removed by a diff are skipped.
+        self._expiry: List[Tuple[int, GroupKey, str]] = []
+        self._dirty: Set[GroupKey] = set()
+        self._view: StopTimes = EMPTY_STOP_TIMES
+
+    def apply(
+        self,
+        source: str,
+        arrivals: Iterable[Arrival],
+        now: float | None = None,
+    ) -> DiffStats:
+        grouped: Dict[str, List[Arrival]] = defaultdict(list)
+        for arrival in arrivals:
+            grouped[arrival.trip_id].append(arrival)
+        new = {trip_id: tuple(sorted(rows)) for trip_id, rows in grouped.items()}
+        old = self._trips.get(source, {})
+
+        inserted = updated = removed = 0
+        for trip_id, old_arrivals in old.items():
+            new_arrivals = new.get(trip_id)
+            if new_arrivals == old_arrivals:
+                continue
+            self._remove(old_arrivals)
+            if new_arrivals is None:
+                removed += 1
+            else:
+                self._insert(new_arrivals)
+                updated += 1
+        for trip_id, new_arrivals in new.items():
+            if trip_id not in old:
+                self._insert(new_arrivals)
+                inserted += 1
+        self._trips[source] = new
+
+        evicted = self.evict(now) if now is not None else 0
+        return DiffStats(inserted, updated, removed, evicted)
+
+    def evict(self, now: float) -> int:
+        evicted = 0
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            ts, key, trip_id = heapq.heappop(expiry)
+            if self._discard(key, ts, trip_id):
+                evicted += 1
+        return evicted
+
+    def view(self) -> StopTimes:
+        """Immutable per-stop view; only stops touched since the last call are copied."""
+        if not self._dirty:
+            return self._view
+        stops = dict(self._view)
+        touched: Dict[str, Dict[Tuple[str, str], Tuple[int, ...]]] = {}
+        for key in self._dirty:
+            stop_id, route, direction = key
+            per_stop = touched.get(stop_id)
+            if per_stop is None:
+                per_stop = touched[stop_id] = dict(stops.get(stop_id, {}))
+            entries = self._groups.get(key)
+            if entries:
+                per_stop[(route, direction)] = tuple(ts for ts, _ in entries)
+            else:
+                per_stop.pop((route, direction), None)
+                self._groups.pop(key, None)
+        for stop_id, per_stop in touched.items():
+            if per_stop:
+                stops[stop_id] = MappingProxyType(per_stop)
+            else:
+                stops.pop(stop_id, None)
+        self._dirty.clear()
+        self._view = MappingProxyType(stops)
+        return self._view
+
+    def _insert(self, arrivals: Tuple[Arrival, ...]) -> None:
+        for arrival in arrivals:
+            key = (arrival.stop_id, arrival.route, arrival.direction)
+            bisect.insort(self._groups.setdefault(key, []), (arrival.time, arrival.trip_id))
+            heapq.heappush(self._expiry, (arrival.time, key, arrival.trip_id))
+            self._dirty.add(key)
+
+    def _remove(self, arrivals: Tuple[Arrival, ...]) -> None:
+        for arrival in arrivals:
+            key = (arrival.stop_id, arrival.route, arrival.direction)
+            self._discard(key, arrival.time, arrival.trip_id)
+
+    def _discard(self, key: GroupKey, ts: int, trip_id: str) -> bool:
+        entries = self._groups.get(key)
+        if not entries:
+            return False
+        entry = (ts, trip_id)
+        i = bisect.bisect_left(entries, entry)
+        if i == len(entries) or entries[i] != entry:
+            return False
+        del entries[i]
+        self._dirty.add(key)
+        return True
+
+
+def schedule_rows(
+    stops: StopTimes,
+    stop_map: Dict[str, str],
+    now: dt.datetime,
+    limit: int | None = 2,
+) -> List[ScheduleRow]:
+    """Same rows as build_schedule(), read from a ScheduleIndex view."""
+    cutoff = now.timestamp()
+    grouped: Dict[Tuple[str, str, str], List[Tuple[int, ...]]] = defaultdict(list)
+    for stop_id, stop_name in stop_map.items():
+        for (route, direction), times in stops.get(stop_id, {}).items():
+            start = bisect.bisect_right(times, cutoff)
+            if start == len(times):
+                continue
+            end = None if limit is None else start + limit
+            grouped[(route, stop_name, direction)].append(times[start:end])
+
+    rows = []
+    for (route, stop_name, direction), runs in grouped.items():
+        # Several stop_ids can share a name (e.g. 718 and R09).
+        times = runs[0] if len(runs) == 1 else tuple(heapq.merge(*runs))
+        if limit is not None:
+            times = times[:limit]
+        rows.append(ScheduleRow(route, stop_name, DIRECTIONS[direction], tuple(times)))
+    rows.sort(key=lambda r: (r.stop_name, r.route, r.direction))
+    return rows
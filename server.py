@@ -1,460 +1,795 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+from functools import lru_cache, partial
+import hmac
 from http.server import BaseHTTPRequestHandler, HTTPServer
+import json
+import logging
 import os
+import shutil
+import signal
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Tuple
+from urllib.parse import parse_qs, urlsplit
 
-from timetable_svg import ROUTE_COLORS, get_schedule, generate_svg_string
+import metrics
+from api import encode_binary, encode_json
+from assets import AssetStore
+from boards import DEFAULT_BOARD, load_boards, parse_stop_ids, watched_stops
+from events import diff_rows, format_event, row_key, rows_by_key
+from feeds import feed_name
+from gtfs_static import close_static_index
+from history import HISTORY_DIR, HistoryRecorder
+from poller import FeedPoller
+from profiler import (
+    PROFILE_TOKEN,
+    dump_on_signal,
+    exclusive,
+    format_collapsed,
+    format_pstats,
+    profiled,
+    run_cprofile,
+    sample_stacks,
+)
+from raster import SUPPORTED_BITS, RasterRenderer, available as raster_available
+from render_cache import RENDER_SECONDS, RenderCache, Rendered, etag_matches
+from snapshot_cache import CACHE_DIR, SnapshotCache
+from snapshot_store import SNAPSHOT_PATH, SnapshotReader, SnapshotWriter
+from timetable_svg import ScheduleRow, format_arrival, render_svg, route_color
+
+log = logging.getLogger(__name__)
+
+# Seconds a request may wait for the first poll round after startup.
+READY_TIMEOUT = 15.0
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "16"))
+# Accepted connections that may wait for a free worker; past that, new ones
+# get an immediate 503 instead of piling up.
+SERVER_QUEUE = int(os.getenv("SERVER_QUEUE", "64"))
+BUSY_RESPONSE = (
+    b"HTTP/1.1 503 Service Unavailable\r\n"
+    b"Retry-After: 1\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+)
+# Live /events streams each hold a pool worker for up to STREAM_LIFETIME, so
+# they may take at most half the pool and are recycled periodically
+# (EventSource reconnects on its own).
+MAX_STREAMS = max(1, min(int(os.getenv("MAX_STREAMS", "8")), SERVER_WORKERS // 2))
+STREAM_KEEPALIVE = 15.0
+STREAM_LIFETIME = 600.0
+stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+# Data-only endpoints for thin clients: path -> (encoder, content type).
+API_FORMATS = {
+    "/api/arrivals.json": (encode_json, "application/json"),
+    "/api/arrivals.bin": (encode_binary, "application/octet-stream"),
+}
+
+# Bitmaps for e-ink walls; packed and diff forms let panels skip PNG decoding.
+RASTER_PATHS = ("/raster.png", "/raster.raw", "/raster.diff")
+RASTER_BITS = 4
+
+# One JSON line per request when set: "1"/"stderr", or a file path.
+ACCESS_LOG = os.getenv("ACCESS_LOG", "")
+access_log = logging.getLogger("access")
+
+boards = load_boards()
+poller = FeedPoller(
+    stop_map=watched_stops(boards),
+    cache=SnapshotCache(CACHE_DIR) if CACHE_DIR else None,
+    recorder=HistoryRecorder(HISTORY_DIR) if HISTORY_DIR else None,
+)
+render_cache = RenderCache()
+raster_renderer = RasterRenderer() if raster_available() else None
+
+HTTP_REQUESTS = metrics.counter("mta_http_requests_total", "HTTP requests served.", ("route", "status"))
+HTTP_SECONDS = metrics.histogram("mta_http_request_seconds", "HTTP request handling time.", ("route",))
+metrics.gauge(
+    "mta_snapshot_age_seconds",
+    "Seconds since the poller last published a snapshot.",
+    collect=lambda: {(): time.time() - poller.snapshot.updated_at} if poller.snapshot.updated_at else {},
+)
+metrics.gauge(
+    "mta_snapshot_version",
+    "Version of the current snapshot.",
+    collect=lambda: {(): poller.snapshot.version},
+)
+
+
+def _feed_ages() -> Dict[tuple, float]:
+    ages = {}
+    for url in poller.urls:
+        age = poller.feed_status(url).age()
+        if age is not None:
+            ages[(feed_name(url),)] = age
+    return ages
+
+
+metrics.gauge("mta_feed_age_seconds", "Seconds since each feed last answered successfully.", ("feed",), _feed_ages)
+metrics.gauge(
+    "mta_feed_failures",
+    "Consecutive failed fetches per feed.",
+    ("feed",),
+    lambda: {(feed_name(url),): poller.feed_status(url).failures for url in poller.urls},
+)
+
+assets = AssetStore()
+assets.add("/manifest.json", "manifest.json", "application/manifest+json; charset=utf-8")
+# The service worker must pick up new versions promptly; browsers revalidate it.
+assets.add("/sw.js", "sw.js", "application/javascript; charset=utf-8", "no-cache")
+assets.add("/icon.svg", "icon.svg", "image/svg+xml; charset=utf-8", "public, max-age=604800")
+assets.add("/favicon.ico", "favicon.ico", "image/x-icon", "public, max-age=604800")
+# Referenced with a content version (see mobile_asset_links), so cache hard.
+assets.add("/mobile.css", "mobile.css", "text/css; charset=utf-8", "public, max-age=31536000, immutable")
+assets.add("/mobile.js", "mobile.js", "application/javascript; charset=utf-8", "public, max-age=31536000, immutable")
+
+
+def render_cached(
+    name: Hashable,
+    limit: int | None,
+    renderer: Callable[[List[ScheduleRow], dt.datetime], str | bytes],
+    stop_map: Dict[str, str] | None = None,
+) -> Rendered:
+    # Rows are filtered against the real time; the rendered output is reused
+    # for as long as view_key() says it would come out the same.
+    stop_map = stop_map or boards[DEFAULT_BOARD]
+    endpoint = name[0] if isinstance(name, tuple) else name
+    snapshot = poller.current(READY_TIMEOUT)
+    rows, now = snapshot.schedule(stop_map=stop_map, limit=limit)
+    key = (name, snapshot.version, view_key(rows, now))
+
+    def render() -> bytes:
+        with RENDER_SECONDS.time(endpoint=endpoint):
+            output = renderer(rows, now)
+        return output.encode("utf-8") if isinstance(output, str) else output
+
+    return render_cache.get_or_render(key, render)
+
+
+def view_key(rows: List[ScheduleRow], now: dt.datetime) -> Hashable:
+    # A view only changes when the clock's minute ticks over, a train departs
+    # (drops out of ``rows``) or one of the shown countdowns ticks down.
+    ts = now.timestamp()
+    return (
+        now.replace(second=0, microsecond=0),
+        tuple((row, tuple(int((t - ts) // 60) for t in row.times)) for row in rows),
+    )
+
+
+def feed_freshness() -> str:
+    # e.g. "gtfs-ace=12, gtfs-g=340;stale;open, gtfs-l=missing": seconds since
+    # each feed last answered, flagged when its last copy is being served
+    # after a failure; "missing" when it has never answered.
+    now = time.time()
+    parts = []
+    for url in poller.urls:
+        status = poller.feed_status(url)
+        age = status.age(now)
+        if age is None:
+            part = f"{feed_name(url)}=missing"
+        else:
+            part = f"{feed_name(url)}={int(age)}"
+            if status.error:
+                part += ";stale"
+        if status.circuit != "closed":
+            part += f";{status.circuit}"
+        parts.append(part)
+    return ", ".join(parts)
+
+
+def _esc(text: str) -> str:
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
+
+
+# The mobile page is prebuilt byte chunks around a few dynamic slots; its CSS
+# and JS are separate assets so browsers cache them across refreshes.
+MOBILE_HEAD = (
+    b'<!doctype html>\n<html lang="en">\n<head>\n'
+    b'<meta charset="utf-8" />\n'
+    b'<meta name="viewport" content="width=device-width, initial-scale=1" />\n'
+    b"<title>Jackson Park MTA Arrivals</title>\n"
+    b'<link rel="manifest" href="/manifest.json" />\n'
+    b'<link rel="icon" href="/icon.svg" />\n'
+    b'<link rel="shortcut icon" href="/favicon.ico" />\n'
+    b'<meta name="theme-color" content="#111111" />\n'
+)
+MOBILE_BODY = (
+    b'</head>\n<body data-theme="light">\n<header>\n'
+    b'<div class="title">Jackson Park MTA Arrivals</div>\n'
+    b'<div class="actions">\n'
+    b'<button class="theme-toggle" type="button" aria-pressed="false">Dark</button>\n'
+    b'<button class="refresh" type="button" aria-label="Refresh arrivals" title="Refresh">'
+    b'<svg viewBox="0 0 24 24" aria-hidden="true" fill="none" stroke="currentColor" stroke-width="2" '
+    b'stroke-linecap="round" stroke-linejoin="round">'
+    b'<path d="M21 12a9 9 0 1 1-2.64-6.36" /><polyline points="21 3 21 9 15 9" /></svg></button>\n'
+    b'<div class="asof">As of '
+)
+MOBILE_MAIN = b" ET</div>\n</div>\n</header>\n<main>\n"
+MOBILE_TAIL = b"</main>\n</body>\n</html>\n"
+MOBILE_EMPTY = b'<div class="empty">No arrivals found.</div>\n'
+MORE_HEAD = (
+    b'<div class="more"><button class="more-toggle" type="button" aria-expanded="false">'
+    b'More trains</button><ul class="more-list">'
+)
+MORE_TAIL = b"</ul></div>"
+CARD_TAIL = b"</article>\n"
+
+
+@lru_cache(maxsize=1024)
+def _card_head(route: str, stop_name: str, direction: str) -> bytes:
+    key = _esc(row_key(ScheduleRow(route, stop_name, direction, ())))
+    return (
+        f'<article class="card" data-key="{key}">'
+        f'<div class="badge" style="background:{route_color(route)}">{_esc(route)}</div>'
+        f'<div class="meta"><div class="stop">{_esc(stop_name)} <span class="dir">{_esc(direction)}</span></div></div>'
+    ).encode("utf-8")
+
+
+def mobile_asset_links() -> bytes:
+    # Content-versioned URLs let the assets carry a long max-age.
+    links = []
+    for path, template in (
+        ("/mobile.css", '<link rel="stylesheet" href="{}" />\n'),
+        ("/mobile.js", '<script src="{}" defer></script>\n'),
+    ):
+        asset = assets.get(path)
+        version = f"?v={asset.rendered.digest[:10]}" if asset is not None else ""
+        links.append(template.format(path + version))
+    return "".join(links).encode("utf-8")
+
+
+def render_mobile(rows: List[ScheduleRow], now: dt.datetime, links: bytes = b"") -> bytes:
+    chunks = [MOBILE_HEAD, links, MOBILE_BODY, now.strftime("%a %b %d %H:%M").encode(), MOBILE_MAIN]
+    for row in rows:
+        times = row.times
+        t1 = format_arrival(times[0], now) if len(times) > 0 else "--:--"
+        t2 = format_arrival(times[1], now) if len(times) > 1 else "--:--"
+        chunks.append(_card_head(row.route, row.stop_name, row.direction))
+        chunks.append(
+            f'<div class="times"><div class="time">{t1}</div><div class="time muted">{t2}</div></div>'.encode("utf-8")
+        )
+        if len(times) > 2:
+            chunks.append(MORE_HEAD)
+            chunks.append("".join(f"<li>{format_arrival(t, now)}</li>" for t in times[2:]).encode("utf-8"))
+            chunks.append(MORE_TAIL)
+        chunks.append(CARD_TAIL)
+    if not rows:
+        chunks.append(MOBILE_EMPTY)
+    chunks.append(MOBILE_TAIL)
+    return b"".join(chunks)
+
+
+class PooledHTTPServer(HTTPServer):
+    """HTTPServer that handles requests on a fixed-size worker pool.
+
+    At most ``workers + queue`` connections are in flight; the accept loop
+    answers any beyond that with a 503 rather than queueing them.
+    """
+
+    def __init__(self, server_address, handler_class, workers: int = 16, queue: int = SERVER_QUEUE) -> None:
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="http")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    def process_request(self, request, client_address) -> None:
+        if not self._slots.acquire(blocking=False):
+            self._reject(request)
+            return
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:  # pool already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address) -> None:
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def _reject(self, request) -> None:
+        # Runs on the accept loop, so never wait on the client.
+        HTTP_REQUESTS.inc(route="busy", status="503")
+        try:
+            request.setblocking(False)
+            request.send(BUSY_RESPONSE)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        super().server_close()
+        # Let in-flight requests finish; drop ones that never started.
+        self._pool.shutdown(wait=True, cancel_futures=True)
 
 
 class SvgHandler(BaseHTTPRequestHandler):
+    # Seconds a client may stall on the socket before its worker is released.
+    timeout = 30
+
     def do_GET(self) -> None:
-        if self.path in ("/", "/mobile"):
-            self._handle_mobile()
-            return
-        if self.path in ("/timetable.svg", "/svg"):
-            self._handle_svg()
-            return
-        if self.path == "/manifest.json":
-            self._serve_file("manifest.json", "application/manifest+json; charset=utf-8")
-            return
-        if self.path == "/sw.js":
-            self._serve_file("sw.js", "application/javascript; charset=utf-8")
+        started = time.perf_counter()
+        self._status = 0
+        self._sent_bytes = 0
+        self._encoding = None
+        route, board_id = "other", ""
+        try:
+            with profiled("request"):
+                route, board_id = self._dispatch()
+        finally:
+            elapsed = time.perf_counter() - started
+            HTTP_REQUESTS.inc(route=route, status=str(self._status))
+            HTTP_SECONDS.observe(elapsed, route=route)
+            if access_log.handlers:
+                access_log.info(json.dumps({
+                    "ts": round(time.time(), 3),
+                    "client": self.client_address[0],
+                    "method": self.command,
+                    "path": self.path,
+                    "route": route,
+                    "board": board_id,
+                    "status": self._status,
+                    "bytes": self._sent_bytes,
+                    "ms": round(elapsed * 1000, 2),
+                    "encoding": self._encoding,
+                    "ua": self.headers.get("User-Agent", ""),
+                }, separators=(",", ":")))
+
+    def _dispatch(self) -> Tuple[str, str]:
+        # Returns (route, board) for metrics and the access log.
+        url = urlsplit(self.path)
+        path = url.path
+        query = parse_qs(url.query)
+        board_id = DEFAULT_BOARD
+        if path.startswith("/board/"):
+            board_id, _, view = path[len("/board/"):].partition("/")
+            path = "/" + view
+
+        if (
+            path in ("/", "/mobile", "/timetable.svg", "/svg", "/events")
+            or path in API_FORMATS
+            or path in RASTER_PATHS
+        ):
+            stop_map = self._stop_map(board_id, query)
+            if stop_map is None:
+                return path, board_id
+            if path in ("/", "/mobile"):
+                self._handle_mobile(stop_map)
+            elif path == "/events":
+                self._handle_events(stop_map)
+            elif path in API_FORMATS:
+                self._handle_api(path, stop_map, query)
+            elif path in RASTER_PATHS:
+                self._handle_raster(path, stop_map, query)
+            else:
+                self._handle_svg(stop_map)
+            return path, board_id
+        if path == "/metrics" and board_id == DEFAULT_BOARD:
+            self._handle_metrics()
+            return path, board_id
+        if path == "/admin/profile" and board_id == DEFAULT_BOARD and PROFILE_TOKEN:
+            self._handle_profile(query)
+            return path, board_id
+        if path in assets and board_id == DEFAULT_BOARD:
+            self._serve_asset(path)
+            return "asset", board_id
+
+        self.send_error(404, "Not found")
+        return "other", board_id
+
+    def send_response(self, code: int, message: str | None = None) -> None:
+        self._status = code
+        super().send_response(code, message)
+
+    def _handle_profile(self, query: Dict[str, List[str]]) -> None:
+        # ?mode=sample (collapsed stacks of all threads, wall clock) or
+        # ?mode=cprofile&format=pstats|text, for ?seconds=N or ?requests=N.
+        auth = self.headers.get("Authorization", "")
+        if not hmac.compare_digest(auth.encode(), f"Bearer {PROFILE_TOKEN}".encode()):
+            self.send_error(403, "Forbidden")
             return
-        if self.path == "/icon.svg":
-            self._serve_file("icon.svg", "image/svg+xml; charset=utf-8")
+        try:
+            seconds = float(query.get("seconds", ["10"])[0])
+            requests = int(query["requests"][0]) if "requests" in query else None
+        except ValueError:
+            self.send_error(400, "seconds and requests must be numbers")
             return
-        if self.path == "/favicon.ico":
-            self._serve_file("favicon.ico", "image/x-icon")
+        mode = query.get("mode", ["sample"])[0]
+        fmt = query.get("format", ["text"])[0]
+        if mode not in ("sample", "cprofile") or fmt not in ("text", "pstats"):
+            self.send_error(400, "mode must be sample or cprofile; format text or pstats")
             return
 
-        self.send_error(404, "Not found")
-
-    def _handle_svg(self) -> None:
-        svg = generate_svg_string()
-        payload = svg.encode("utf-8")
+        with exclusive() as acquired:
+            if not acquired:
+                self.send_error(409, "A profile is already running")
+                return
+            if mode == "sample":
+                body = format_collapsed(sample_stacks(seconds, include_idle="idle" in query))
+                content_type = "text/plain; charset=utf-8"
+            else:
+                stats = run_cprofile(seconds, requests)
+                body = format_pstats(stats, text=fmt == "text")
+                content_type = "text/plain; charset=utf-8" if fmt == "text" else "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+        self._sent_bytes = len(body)
 
+    def _handle_metrics(self) -> None:
+        body = metrics.REGISTRY.render()
         self.send_response(200)
-        self.send_header("Content-Type", "image/svg+xml; charset=utf-8")
-        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("Content-Type", metrics.CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
         self.end_headers()
-        self.wfile.write(payload)
+        self.wfile.write(body)
+        self._sent_bytes = len(body)
 
-    def _handle_mobile(self) -> None:
-        rows, now = get_schedule(limit=None)
+    def _stop_map(self, board_id: str, query: Dict[str, List[str]]) -> Dict[str, str] | None:
+        # Boards and ?stops= only select from the stops the poller already
+        # ingests; nothing here triggers another fetch or parse.
+        if board_id not in boards:
+            self.send_error(404, "Unknown board")
+            return None
+        stop_map = boards[board_id]
+        if "stops" in query:
+            stop_ids = parse_stop_ids(",".join(query["stops"]))
+            untracked = [stop_id for stop_id in stop_ids if stop_id not in poller.stop_index.stop_map]
+            if not stop_ids or untracked:
+                self.send_error(400, f"Stops not tracked: {', '.join(untracked) or 'none given'}")
+                return None
+            watched = poller.stop_index.stop_map
+            stop_map = {stop_id: stop_map.get(stop_id) or watched[stop_id] for stop_id in stop_ids}
+        return stop_map
 
-        def esc(text: str) -> str:
-            return (
-                text.replace("&", "&amp;")
-                .replace("<", "&lt;")
-                .replace(">", "&gt;")
-                .replace('"', "&quot;")
-            )
+    def _handle_svg(self, stop_map: Dict[str, str]) -> None:
+        rendered = render_cached("svg", 2, render_svg, stop_map)
+        self._send_rendered(rendered, "image/svg+xml; charset=utf-8", headers={"X-Feed-Freshness": feed_freshness()})
 
-        def fmt_time(t, now_dt) -> str:
-            minutes = max(0, int((t - now_dt).total_seconds() // 60))
-            return f"{t.strftime('%H:%M')} · {minutes}m"
-
-        cards = []
-        for row in rows:
-            route = str(row["route"])
-            stop_name = str(row["stop_name"])
-            direction = str(row["direction"])
-            times = row["times"]
-            t1 = fmt_time(times[0], now) if len(times) > 0 else "--:--"
-            t2 = fmt_time(times[1], now) if len(times) > 1 else "--:--"
-            remaining = [fmt_time(t, now) for t in times[2:]]
-            color = ROUTE_COLORS.get(route, "#222222")
-            extra_html = ""
-            if remaining:
-                items = "".join(f"<li>{esc(t)}</li>" for t in remaining)
-                extra_html = f"""
-        <div class="more">
-          <button class="more-toggle" type="button" aria-expanded="false">More trains</button>
-          <ul class="more-list">
-            {items}
-          </ul>
-        </div>
-"""
-            cards.append(f"""
-      <article class="card">
-        <div class="badge" style="background:{color}">{esc(route)}</div>
-        <div class="meta">
-          <div class="stop">{esc(stop_name)} <span class="dir">{esc(direction)}</span></div>
-        </div>
-        <div class="times">
-          <div class="time">{esc(t1)}</div>
-          <div class="time muted">{esc(t2)}</div>
-        </div>
-        {extra_html}
-      </article>
-""")
-
-        cards_html = (
-            "".join(cards) if cards else '<div class="empty">No arrivals found.</div>'
-        )
-        html = f"""<!doctype html>
-<html lang="en">
-  <head>
-    <meta charset="utf-8" />
-    <meta name="viewport" content="width=device-width, initial-scale=1" />
-    <title>Jackson Park MTA Arrivals</title>
-    <link rel="manifest" href="/manifest.json" />
-    <link rel="icon" href="/icon.svg" />
-    <link rel="shortcut icon" href="/favicon.ico" />
-    <meta name="theme-color" content="#111111" />
-    <style>
-      :root {{
-        color-scheme: light dark;
-        --bg: #fafaf7;
-        --card: #ffffff;
-        --text: #151515;
-        --muted: #5c6169;
-        --muted-2: #6f6f6f;
-        --shadow: 0 10px 24px rgba(0, 0, 0, 0.06);
-        --button-bg: rgba(0, 0, 0, 0.06);
-        --button-text: #151515;
-      }}
-      @media (prefers-color-scheme: dark) {{
-        :root {{
-          --bg: #0f1114;
-          --card: #161a20;
-          --text: #f2f2f2;
-          --muted: #9aa3ad;
-          --muted-2: #7f8792;
-          --shadow: 0 12px 28px rgba(0, 0, 0, 0.45);
-          --button-bg: rgba(255, 255, 255, 0.12);
-          --button-text: #f2f2f2;
-        }}
-      }}
-      body[data-theme="dark"] {{
-        --bg: #0f1114;
-        --card: #161a20;
-        --text: #f2f2f2;
-        --muted: #9aa3ad;
-        --muted-2: #7f8792;
-        --shadow: 0 12px 28px rgba(0, 0, 0, 0.45);
-        --button-bg: rgba(255, 255, 255, 0.12);
-        --button-text: #f2f2f2;
-      }}
-      body[data-theme="light"] {{
-        --bg: #fafaf7;
-        --card: #ffffff;
-        --text: #151515;
-        --muted: #5c6169;
-        --muted-2: #6f6f6f;
-        --shadow: 0 10px 24px rgba(0, 0, 0, 0.06);
-        --button-bg: rgba(0, 0, 0, 0.06);
-        --button-text: #151515;
-      }}
-      body {{
-        margin: 0;
-        font-family: "Avenir Next", Avenir, "Helvetica Neue", Helvetica, Arial, sans-serif;
-        background: var(--bg);
-        color: var(--text);
-        transition: background-color 240ms ease, color 240ms ease;
-      }}
-      header {{
-        padding: 20px 18px 10px;
-        display: flex;
-        align-items: baseline;
-        justify-content: space-between;
-        gap: 12px;
-        animation: fade-in 420ms ease-out;
-      }}
-      .title {{
-        font-size: 20px;
-        font-weight: 600;
-        letter-spacing: 0.12em;
-        text-transform: uppercase;
-      }}
-      .asof {{
-        font-size: 14px;
-        color: var(--muted-2);
-      }}
-      .actions {{
-        display: inline-flex;
-        align-items: center;
-        gap: 10px;
-      }}
-      .theme-toggle {{
-        appearance: none;
-        border: 0;
-        border-radius: 999px;
-        padding: 6px 12px;
-        font-size: 14px;
-        font-weight: 600;
-        background: var(--button-bg);
-        color: var(--button-text);
-        cursor: pointer;
-        transition: background-color 240ms ease, color 240ms ease;
-      }}
-      .refresh {{
-        appearance: none;
-        border: 0;
-        border-radius: 999px;
-        width: 36px;
-        height: 36px;
-        background: var(--button-bg);
-        color: var(--button-text);
-        cursor: pointer;
-        display: grid;
-        place-items: center;
-        transition: background-color 240ms ease, color 240ms ease;
-      }}
-      .refresh svg {{
-        width: 18px;
-        height: 18px;
-        display: block;
-      }}
-      .refresh.spin svg {{
-        animation: spin 600ms linear infinite;
-      }}
-      main {{
-        padding: 6px 18px 18px;
-        display: grid;
-        gap: 12px;
-      }}
-      .card {{
-        display: grid;
-        grid-template-columns: 52px 1fr auto;
-        align-items: center;
-        gap: 12px;
-        padding: 12px 14px;
-        background: var(--card);
-        border-radius: 14px;
-        box-shadow: var(--shadow);
-        transition: background-color 240ms ease, box-shadow 240ms ease;
-        animation: rise-in 520ms ease-out both;
-      }}
-      .more {{
-        grid-column: 1 / -1;
-        margin-top: 8px;
-        font-size: 20px;
-        color: var(--muted);
-      }}
-      .more-toggle {{
-        appearance: none;
-        background: transparent;
-        border: 0;
-        padding: 0;
-        font: inherit;
-        font-weight: 600;
-        color: inherit;
-        cursor: pointer;
-      }}
-      .more-toggle::after {{
-        content: "▾";
-        margin-left: 6px;
-        font-size: 12px;
-        color: var(--muted-2);
-      }}
-      .more.open .more-toggle::after {{
-        content: "▴";
-      }}
-      .more-list {{
-        margin: 8px 0 0;
-        padding-left: 18px;
-        display: grid;
-        gap: 4px;
-        color: var(--muted-2);
-        max-height: 0;
-        opacity: 0;
-        transform: translateY(-4px);
-        overflow: hidden;
-        transition: max-height 260ms ease, opacity 260ms ease, transform 260ms ease;
-      }}
-      .more.open .more-list {{
-        opacity: 1;
-        transform: translateY(0);
-      }}
-      .badge {{
-        width: 58px;
-        height: 58px;
-        border-radius: 29px;
-        display: grid;
-        place-items: center;
-        color: #ffffff;
-        font-weight: 700;
-        font-size: 24px;
-      }}
-      .stop {{
-        font-size: 20px;
-        font-weight: 600;
-      }}
-      .dir {{
-        font-size: 20px;
-        color: var(--muted);
-        margin-left: 6px;
-        font-weight: 500;
-      }}
-      .times {{
-        text-align: right;
-        display: grid;
-        gap: 6px;
-        font-weight: 600;
-        font-size: 20px;
-      }}
-      .muted {{
-        color: var(--muted-2);
-        font-weight: 500;
-      }}
-      .empty {{
-        padding: 22px 0;
-        text-align: center;
-        color: var(--muted-2);
-      }}
-      @keyframes rise-in {{
-        from {{
-          opacity: 0;
-          transform: translateY(10px);
-        }}
-        to {{
-          opacity: 1;
-          transform: translateY(0);
-        }}
-      }}
-      @keyframes fade-in {{
-        from {{
-          opacity: 0;
-        }}
-        to {{
-          opacity: 1;
-        }}
-      }}
-      @keyframes spin {{
-        from {{
-          transform: rotate(0deg);
-        }}
-        to {{
-          transform: rotate(360deg);
-        }}
-      }}
-      .card:nth-child(1) {{ animation-delay: 40ms; }}
-      .card:nth-child(2) {{ animation-delay: 80ms; }}
-      .card:nth-child(3) {{ animation-delay: 120ms; }}
-      .card:nth-child(4) {{ animation-delay: 160ms; }}
-      .card:nth-child(5) {{ animation-delay: 200ms; }}
-      .card:nth-child(6) {{ animation-delay: 240ms; }}
-      .card:nth-child(7) {{ animation-delay: 280ms; }}
-      .card:nth-child(8) {{ animation-delay: 320ms; }}
-    </style>
-  </head>
-  <body data-theme="light">
-    <header>
-      <div class="title">Jackson Park MTA Arrivals</div>
-      <div class="actions">
-        <button class="theme-toggle" type="button" aria-pressed="false">Dark</button>
-        <button class="refresh" type="button" aria-label="Refresh arrivals" title="Refresh">
-          <svg viewBox="0 0 24 24" aria-hidden="true" fill="none" stroke="currentColor" stroke-width="2" stroke-linecap="round" stroke-linejoin="round">
-            <path d="M21 12a9 9 0 1 1-2.64-6.36" />
-            <polyline points="21 3 21 9 15 9" />
-          </svg>
-        </button>
-        <div class="asof">As of {now.strftime("%a %b %d %H:%M")} ET</div>
-      </div>
-    </header>
-    <main>
-      {cards_html}
-    </main>
-    <script>
-      if ("serviceWorker" in navigator) {{
-        window.addEventListener("load", () => {{
-          navigator.serviceWorker.register("/sw.js");
-        }});
-      }}
-      const refreshButton = document.querySelector(".refresh");
-      const themeButton = document.querySelector(".theme-toggle");
-      const storedTheme = localStorage.getItem("theme");
-      const initialTheme = storedTheme || "light";
-      document.body.setAttribute("data-theme", initialTheme);
-      if (themeButton) {{
-        themeButton.setAttribute("aria-pressed", initialTheme === "dark" ? "true" : "false");
-        themeButton.textContent = initialTheme === "dark" ? "Light" : "Dark";
-      }}
-      if (themeButton) {{
-        themeButton.addEventListener("click", () => {{
-          const current = document.body.getAttribute("data-theme");
-          const next = current === "dark" ? "light" : "dark";
-          document.body.setAttribute("data-theme", next);
-          localStorage.setItem("theme", next);
-          themeButton.setAttribute("aria-pressed", next === "dark" ? "true" : "false");
-          themeButton.textContent = next === "dark" ? "Light" : "Dark";
-        }});
-      }}
-      const triggerRefresh = () => {{
-        if (refreshButton) refreshButton.classList.add("spin");
-        window.location.reload();
-      }};
-      if (refreshButton) {{
-        refreshButton.addEventListener("click", triggerRefresh);
-      }}
-      setInterval(triggerRefresh, 30000);
-      const toggleSection = (section) => {{
-        const button = section.querySelector(".more-toggle");
-        const list = section.querySelector(".more-list");
-        if (!button || !list) return;
-        const isOpen = section.classList.toggle("open");
-        button.setAttribute("aria-expanded", String(isOpen));
-        if (isOpen) {{
-          list.style.maxHeight = list.scrollHeight + "px";
-        }} else {{
-          list.style.maxHeight = "0px";
-        }}
-      }};
-      document.querySelectorAll(".more").forEach((section) => {{
-        const button = section.querySelector(".more-toggle");
-        if (!button) return;
-        button.addEventListener("click", (event) => {{
-          event.stopPropagation();
-          toggleSection(section);
-        }});
-      }});
-      document.querySelectorAll(".card").forEach((card) => {{
-        const section = card.querySelector(".more");
-        if (!section) return;
-        card.addEventListener("click", (event) => {{
-          if (event.target.closest(".more-toggle")) return;
-          toggleSection(section);
-        }});
-      }});
-    </script>
-  </body>
-</html>
-"""
-        payload = html.encode("utf-8")
-        self.send_response(200)
-        self.send_header("Content-Type", "text/html; charset=utf-8")
-        self.send_header("Content-Length", str(len(payload)))
-        self.end_headers()
-        self.wfile.write(payload)
+    def _handle_mobile(self, stop_map: Dict[str, str]) -> None:
+        links = mobile_asset_links()
+        rendered = render_cached(("mobile", links), None, partial(render_mobile, links=links), stop_map)
+        self._send_rendered(rendered, "text/html; charset=utf-8", headers={"X-Feed-Freshness": feed_freshness()})
 
-    def _serve_file(self, path: str, content_type: str) -> None:
+    def _handle_api(self, path: str, stop_map: Dict[str, str], query: Dict[str, List[str]]) -> None:
+        limit = None
+        if "limit" in query:
+            try:
+                limit = int(query["limit"][0])
+            except ValueError:
+                limit = -1
+            if limit < 0:
+                self.send_error(400, "limit must be a non-negative integer")
+                return
+        encoder, content_type = API_FORMATS[path]
+        rendered = render_cached(path, limit, encoder, stop_map)
+        self._send_rendered(rendered, content_type, headers={"X-Feed-Freshness": feed_freshness()})
+
+    def _handle_raster(self, path: str, stop_map: Dict[str, str], query: Dict[str, List[str]]) -> None:
+        if raster_renderer is None:
+            self.send_error(501, "Raster output requires Pillow")
+            return
         try:
-            with open(path, "rb") as handle:
-                data = handle.read()
-        except OSError:
+            bits = int(query.get("bits", [RASTER_BITS])[0])
+        except ValueError:
+            bits = 0
+        if bits not in SUPPORTED_BITS:
+            self.send_error(400, f"bits must be one of {', '.join(map(str, SUPPORTED_BITS))}")
+            return
+
+        snapshot = poller.current(READY_TIMEOUT)
+        rows, now = snapshot.schedule(stop_map=stop_map, limit=2)
+        frame = raster_renderer.render((snapshot.version, view_key(rows, now)), lambda: rows, now, bits)
+        headers = {"X-Frame-Id": frame.frame_id, "X-Feed-Freshness": feed_freshness()}
+        if path == "/raster.png":
+            rendered = render_cache.get_or_render(("raster.png", frame.frame_id), frame.png, compress=False)
+            self._send_rendered(rendered, "image/png", headers=headers)
+            return
+
+        headers.update({"X-Width": str(frame.image.width), "X-Height": str(frame.image.height), "X-Bits": str(bits)})
+        if path == "/raster.raw":
+            rendered = render_cache.get_or_render(("raster.raw", frame.frame_id), lambda: frame.packed)
+        else:
+            since = query.get("since", [""])[0]
+            rendered = render_cache.get_or_render(
+                ("raster.diff", since, frame.frame_id),
+                lambda: raster_renderer.diff(since, frame),
+            )
+        self._send_rendered(rendered, "application/octet-stream", headers=headers)
+
+    def _handle_events(self, stop_map: Dict[str, str]) -> None:
+        # Server-Sent Events: one full "snapshot" event, then a "delta" with
+        # changed and removed rows each time the poller publishes new data.
+        if not isinstance(self.server, PooledHTTPServer):
+            # A stream would hold SERVER_MODE=single's only thread for minutes;
+            # the page falls back to reloading instead.
+            self.send_error(503, "Live streams need a pooled server")
+            return
+        if not stream_slots.acquire(blocking=False):
+            self.send_error(503, "Too many live streams")
+            return
+        self.close_connection = True
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("X-Accel-Buffering", "no")
+            self.end_headers()
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.flush()
+
+            sent = None
+            version = -1
+            deadline = time.monotonic() + STREAM_LIFETIME
+            while not poller.stopping and time.monotonic() < deadline:
+                snapshot = poller.wait_for_change(version, timeout=STREAM_KEEPALIVE)
+                if snapshot.version == version:
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                version = snapshot.version
+                rows, now = snapshot.schedule(stop_map=stop_map, limit=None)
+                current = rows_by_key(rows)
+                if sent is None:
+                    frame = format_event(
+                        "snapshot",
+                        {"v": version, "now": int(now.timestamp()), "rows": list(current.values())},
+                        event_id=version,
+                    )
+                else:
+                    changed, removed = diff_rows(sent, current)
+                    if not changed and not removed:
+                        continue
+                    frame = format_event(
+                        "delta",
+                        {"v": version, "now": int(now.timestamp()), "set": changed, "del": removed},
+                        event_id=version,
+                    )
+                self.wfile.write(frame)
+                self.wfile.flush()
+                sent = current
+        except (BrokenPipeError, ConnectionResetError, TimeoutError):
+            pass
+        finally:
+            stream_slots.release()
+
+    def _serve_asset(self, path: str) -> None:
+        asset = assets.get(path)
+        if asset is None:
             self.send_error(404, "Not found")
             return
+        self._send_rendered(
+            asset.rendered,
+            asset.content_type,
+            cache_control=asset.cache_control,
+            last_modified=asset.last_modified,
+        )
+
+    def _send_rendered(
+        self,
+        rendered: Rendered,
+        content_type: str,
+        cache_control: str = "no-cache",
+        last_modified: str | None = None,
+        headers: Dict[str, str] | None = None,
+    ) -> None:
+        headers = headers or {}
+        encoding = rendered.negotiate(self.headers.get("Accept-Encoding"))
+        etag = rendered.etag(encoding)
+        if_none_match = self.headers.get("If-None-Match")
+        if etag_matches(if_none_match, [etag]) or (
+            if_none_match is None
+            and last_modified is not None
+            and self.headers.get("If-Modified-Since") == last_modified
+        ):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", cache_control)
+            self.send_header("Vary", "Accept-Encoding")
+            for name, value in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+            return
+
+        payload = rendered.encodings[encoding] if encoding else rendered.body
         self.send_response(200)
         self.send_header("Content-Type", content_type)
-        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("ETag", etag)
+        self.send_header("Cache-Control", cache_control)
+        self.send_header("Vary", "Accept-Encoding")
+        if last_modified:
+            self.send_header("Last-Modified", last_modified)
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        for name, value in headers.items():
+            self.send_header(name, value)
         self.end_headers()
-        self.wfile.write(data)
+        self.wfile.write(payload)
+        self._sent_bytes = len(payload)
+        self._encoding = encoding
 
     def log_message(self, format: str, *args) -> None:
         return
 
 
-def run_server(host: str = "0.0.0.0", port: int = 8100) -> None:
-    server = HTTPServer((host, port), SvgHandler)
-    print(f"Serving on http://{host}:{port}")
+def make_server(
+    host: str = "0.0.0.0",
+    port: int = 8100,
+    mode: str = "threaded",
+    workers: int = 16,
+    queue: int = SERVER_QUEUE,
+) -> HTTPServer:
+    if mode == "single":
+        return HTTPServer((host, port), SvgHandler)
+    if mode in ("threaded", "prefork"):
+        return PooledHTTPServer((host, port), SvgHandler, workers=workers, queue=queue)
+    raise ValueError(f"Unknown server mode: {mode}")
+
+
+def configure_access_log() -> None:
+    if not ACCESS_LOG:
+        return
+    handler = (
+        logging.StreamHandler()
+        if ACCESS_LOG.lower() in ("1", "true", "stderr")
+        else logging.FileHandler(ACCESS_LOG, encoding="utf-8")
+    )
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    access_log.addHandler(handler)
+    access_log.setLevel(logging.INFO)
+    access_log.propagate = False
+
+
+def serve(server: HTTPServer) -> None:
+    def handle_signal(signum, frame) -> None:
+        # shutdown() blocks until serve_forever() returns, so it can't run on
+        # the main thread that is serving.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    if hasattr(signal, "SIGUSR1"):
+        # kill -USR1 <pid>: sample all threads for 30s into PROFILE_DIR.
+        signal.signal(signal.SIGUSR1, lambda signum, frame: dump_on_signal())
+
+    poller.start()
     try:
         server.serve_forever()
     finally:
+        poller.stop()
         server.server_close()
 
 
+def run_ingester(snapshot_path: str) -> None:
+    # Block the stop signals before any thread starts so only sigwait() sees them.
+    stop_signals = {signal.SIGTERM, signal.SIGINT}
+    signal.pthread_sigmask(signal.SIG_BLOCK, stop_signals)
+    writer = SnapshotWriter(poller, snapshot_path)
+    poller.start()
+    writer.start()
+    try:
+        signal.sigwait(stop_signals)
+    finally:
+        poller.stop()
+        writer.stop()
+
+
+def run_worker(server: HTTPServer, snapshot_path: str) -> None:
+    global poller
+    poller = SnapshotReader(snapshot_path, poller.stop_index.stop_map, poller.urls)
+    serve(server)
+
+
+def run_prefork(server: HTTPServer, processes: int, snapshot_path: str = SNAPSHOT_PATH) -> None:
+    """Fork one feed ingester and ``processes`` HTTP workers sharing ``server``'s socket.
+
+    The ingester polls the feeds and publishes each snapshot to
+    ``snapshot_path``; workers map that file instead of polling themselves.
+    This parent starts no threads, so it can safely re-fork children that die.
+    """
+    children: Dict[int, Tuple[str, float]] = {}
+    stopping = False
+
+    def spawn(role: str) -> None:
+        pid = os.fork()
+        if pid:
+            children[pid] = (role, time.monotonic())
+            return
+        code = 0
+        try:
+            if role == "ingester":
+                run_ingester(snapshot_path)
+            else:
+                run_worker(server, snapshot_path)
+        except BaseException:
+            log.exception("%s %d failed", role, os.getpid())
+            code = 1
+        finally:
+            logging.shutdown()
+            os._exit(code)
+
+    def handle_signal(signum, frame) -> None:
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, handle_signal)
+    signal.signal(signal.SIGINT, handle_signal)
+    if hasattr(signal, "SIGUSR1"):
+        # Profile a worker with kill -USR1 <worker pid>; the parent has nothing to sample.
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+
+    # Feed planning opened the static index at import; children reopen it.
+    close_static_index()
+    # Panels polling /raster.diff land on any worker, so frames are shared.
+    frame_dir = f"{snapshot_path}.frames"
+    if raster_renderer is not None:
+        os.makedirs(frame_dir, exist_ok=True)
+        raster_renderer.frame_dir = frame_dir
+    spawn("ingester")
+    for _ in range(processes):
+        spawn("worker")
+    try:
+        while children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            role, started = children.pop(pid, ("worker", 0.0))
+            if stopping:
+                continue
+            log.warning("%s %d exited with status %d; restarting", role, pid, os.waitstatus_to_exitcode(status))
+            if time.monotonic() - started < 1.0:
+                time.sleep(1.0)  # don't spin on a child that dies at startup
+            spawn(role)
+    finally:
+        server.server_close()
+        try:
+            os.unlink(snapshot_path)
+        except OSError:
+            pass
+        shutil.rmtree(frame_dir, ignore_errors=True)
+
+
+def run_server(
+    host: str = "0.0.0.0",
+    port: int = 8100,
+    mode: str = "threaded",
+    workers: int = 16,
+    processes: int = 1,
+) -> None:
+    server = make_server(host, port, mode=mode, workers=workers)
+    configure_access_log()
+    if mode == "prefork":
+        print(f"Serving on http://{host}:{port} ({mode}, {processes} processes)")
+        run_prefork(server, processes)
+    else:
+        print(f"Serving on http://{host}:{port} ({mode})")
+        serve(server)
+
+
 if __name__ == "__main__":
     env_port = os.getenv("PORT")
     port = int(env_port) if env_port else 8100
-    run_server(port=port)
+    mode = os.getenv("SERVER_MODE", "threaded")
+    processes = int(os.getenv("SERVER_PROCESSES", "0")) or os.cpu_count() or 1
+    run_server(port=port, mode=mode, workers=SERVER_WORKERS, processes=processes)
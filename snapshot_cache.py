@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Dict, NamedTuple, Tuple
+
+from extract import Arrival
+from feeds import MAX_STALE, FetchResult, feed_name
+
+log = logging.getLogger(__name__)
+
+# Where the last good feeds are kept across restarts; disabled when empty.
+CACHE_DIR = os.getenv("SNAPSHOT_CACHE_DIR", "")
+# Cached feeds older than this are not worth showing after a restart. The
+# poller also never restores a feed older than its fetcher's max_stale.
+CACHE_MAX_AGE = float(os.getenv("SNAPSHOT_CACHE_MAX_AGE", str(MAX_STALE)))
+# Minimum seconds between rewrites of the cache while feeds keep changing.
+SAVE_INTERVAL = 5.0
+
+# Reported for restored feeds until their first live fetch succeeds.
+RESTORED = "restored from cache"
+
+# snapshot.bin: magic "MTAC", u8 format, f64 saved_at, u32 payload length, then
+# a marshal payload of (stop_map, {url: (digest, fetched_at, arrival tuples)}).
+# Raw bodies sit next to it as "<feed name>.pb" (replayable with feed_sim.py --replay).
+MAGIC = b"MTAC"
+FORMAT = 1
+_HEADER = struct.Struct("<4sBdI")
+SNAPSHOT_FILE = "snapshot.bin"
+
+
+class CachedFeed(NamedTuple):
+    digest: str
+    fetched_at: float
+    # None when the cache was written for a different set of stops; the raw
+    # body has to be decoded again.
+    arrivals: Tuple[Arrival, ...] | None
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+        handle.flush()
+        os.fsync(handle.fileno())
+    os.replace(tmp_path, path)
+
+
+class SnapshotCache:
+    """Keeps the last good body and arrivals of each feed in ``directory``.
+
+    ``record`` is called with every successful fetch and only stages it; a
+    background thread writes changed bodies and then the arrivals index, each
+    file replaced atomically so a crash leaves the previous copy intact.
+    """
+
+    def __init__(self, directory: str, max_age: float = CACHE_MAX_AGE, interval: float = SAVE_INTERVAL) -> None:
+        self.directory = directory
+        self.max_age = max_age
+        self.interval = interval
+        self._stop_map: Dict[str, str] = {}
+        self._feeds: Dict[str, CachedFeed] = {}
+        self._bodies: Dict[str, bytes] = {}
+        self._unsaved = False
+        self._dirty = threading.Event()
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    def body_path(self, url: str) -> str:
+        return os.path.join(self.directory, f"{feed_name(url)}.pb")
+
+    def load(self, stop_map: Dict[str, str]) -> Dict[str, CachedFeed]:
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        try:
+            with open(path, "rb") as handle, mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                magic, fmt, saved_at, length = _HEADER.unpack_from(mapped, 0)
+                if magic != MAGIC or fmt != FORMAT:
+                    raise ValueError("not a snapshot cache file")
+                with memoryview(mapped)[_HEADER.size:_HEADER.size + length] as payload:
+                    cached_stops, feeds = marshal.loads(payload)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError, EOFError, struct.error) as exc:
+            log.warning("ignoring snapshot cache %s: %s", path, exc)
+            return {}
+
+        same_stops = cached_stops == stop_map
+        oldest = time.time() - self.max_age
+        restored = {}
+        for url, (digest, fetched_at, rows) in feeds.items():
+            if fetched_at < oldest:
+                continue
+            arrivals = tuple(Arrival._make(row) for row in rows) if same_stops else None
+            restored[url] = CachedFeed(digest, fetched_at, arrivals)
+        return restored
+
+    def read_body(self, url: str) -> bytes | None:
+        try:
+            with open(self.body_path(url), "rb") as handle:
+                return handle.read()
+        except OSError:
+            return None
+
+    def record(self, result: FetchResult, stop_map: Dict[str, str]) -> None:
+        with self._lock:
+            self._stop_map = stop_map
+            self._feeds[result.url] = CachedFeed(result.digest, result.fetched_at, result.decoded)
+            if result.body is not None:
+                self._bodies[result.url] = result.body
+            self._unsaved = True
+        self._dirty.set()
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._unsaved:
+                return
+            self._unsaved = False
+            bodies, self._bodies = self._bodies, {}
+            stop_map = dict(self._stop_map)
+            feeds = {
+                url: (feed.digest, feed.fetched_at, tuple(tuple(arrival) for arrival in feed.arrivals))
+                for url, feed in self._feeds.items()
+            }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # Bodies first: the index never points at a body that isn't on disk.
+            for url, body in bodies.items():
+                _write_atomic(self.body_path(url), body)
+            payload = marshal.dumps((stop_map, feeds))
+            header = _HEADER.pack(MAGIC, FORMAT, time.time(), len(payload))
+            _write_atomic(os.path.join(self.directory, SNAPSHOT_FILE), header + payload)
+        except OSError:
+            # Stage everything again for the next save; newer bodies win.
+            with self._lock:
+                for url, body in bodies.items():
+                    self._bodies.setdefault(url, body)
+                self._unsaved = True
+            self._dirty.set()
+            raise
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="snapshot-cache", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        self._stopping.set()
+        self._dirty.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        while True:
+            self._dirty.wait()
+            stopping = self._stopping.is_set()
+            self._dirty.clear()
+            try:
+                self.save()
+            except OSError as exc:
+                log.warning("snapshot cache write to %s failed: %s", self.directory, exc)
+            if stopping:
+                return
+            # Coalesce bursts of feed updates into one write.
+            self._stopping.wait(self.interval)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import logging
+import marshal
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+from typing import Dict, List, Tuple
+
+from extract import StopIndex
+from feeds import FeedStatus
+from poller import FeedPoller, FeedState, Snapshot
+
+log = logging.getLogger(__name__)
+
+_SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", os.path.join(_SHM_DIR, f"mta-wall-{os.getpid()}.snapshot"))
+# Seconds between republishing an unchanged snapshot, so feed ages and
+# circuit states seen by readers stay current.
+STATUS_INTERVAL = 5.0
+
+# File layout: magic "MTAS", u8 format, u64 snapshot version, f64 updated_at,
+# u32 payload length, then a marshal payload of
+# (stop_map, stops, {url: (fetched_at, error)}, {url: FeedStatus fields}).
+# Writers replace the whole file atomically, so readers never see a partial one.
+MAGIC = b"MTAS"
+FORMAT = 1
+_HEADER = struct.Struct("<4sBQdI")
+
+
+def encode_snapshot(snapshot: Snapshot, statuses: Dict[str, FeedStatus]) -> bytes:
+    payload = marshal.dumps((
+        dict(snapshot.stop_map),
+        {stop_id: dict(groups) for stop_id, groups in snapshot.stops.items()},
+        {url: (state.fetched_at, state.error) for url, state in snapshot.feeds.items()},
+        {
+            url: (status.fetched_at, status.failures, status.error, status.circuit)
+            for url, status in statuses.items()
+        },
+    ))
+    header = _HEADER.pack(MAGIC, FORMAT, snapshot.version, snapshot.updated_at, len(payload))
+    return header + payload
+
+
+def decode_snapshot(data) -> Tuple[Snapshot, Dict[str, FeedStatus]]:
+    magic, fmt, version, updated_at, length = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or fmt != FORMAT:
+        raise ValueError("not a snapshot file")
+    with memoryview(data)[_HEADER.size:_HEADER.size + length] as payload:
+        stop_map, stops, feeds, statuses = marshal.loads(payload)
+    snapshot = Snapshot(
+        version=version,
+        feeds=MappingProxyType({
+            url: FeedState(url, (), fetched_at, error) for url, (fetched_at, error) in feeds.items()
+        }),
+        updated_at=updated_at,
+        stop_map=MappingProxyType(stop_map),
+        stops=MappingProxyType({
+            stop_id: MappingProxyType(groups) for stop_id, groups in stops.items()
+        }),
+    )
+    return snapshot, {url: FeedStatus(url, *fields) for url, fields in statuses.items()}
+
+
+def write_snapshot(path: str, data: bytes) -> None:
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as handle:
+        handle.write(data)
+    os.replace(tmp_path, path)
+
+
+class SnapshotWriter:
+    """Publishes a poller's snapshots to ``path`` for other processes."""
+
+    def __init__(self, poller: FeedPoller, path: str = SNAPSHOT_PATH, interval: float = STATUS_INTERVAL) -> None:
+        self.poller = poller
+        self.path = path
+        self.interval = interval
+        self._thread: threading.Thread | None = None
+
+    def publish(self, snapshot: Snapshot) -> None:
+        statuses = {url: self.poller.feed_status(url) for url in self.poller.urls}
+        write_snapshot(self.path, encode_snapshot(snapshot, statuses))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float | None = 5.0) -> None:
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        # Readers treat a missing file as "not ready", so wait for the first
+        # poll round before publishing anything.
+        snapshot = self.poller.current(timeout=None)
+        while not self.poller.stopping:
+            try:
+                self.publish(snapshot)
+            except OSError as exc:
+                log.warning("snapshot publish to %s failed: %s", self.path, exc)
+            snapshot = self.poller.wait_for_change(snapshot.version, timeout=self.interval)
+
+
+class SnapshotReader:
+    """Read-only stand-in for FeedPoller backed by a SnapshotWriter's file.
+
+    The file is mapped and decoded only when it has been replaced (checked
+    at most every ``check_interval`` seconds); in between, readers share the
+    decoded Snapshot like they would a local poller's.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        stop_map: Dict[str, str],
+        urls: List[str],
+        check_interval: float = 0.2,
+    ) -> None:
+        self.path = path
+        self.stop_index = StopIndex(stop_map)
+        self.urls = list(urls)
+        self.check_interval = check_interval
+        self._snapshot = Snapshot(
+            version=0,
+            feeds=MappingProxyType({}),
+            updated_at=0.0,
+            stop_map=MappingProxyType(self.stop_index.stop_map),
+            stops=MappingProxyType({}),
+        )
+        self._statuses: Dict[str, FeedStatus] = {}
+        self._file_id: Tuple[int, int] | None = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+
+    @property
+    def snapshot(self) -> Snapshot:
+        self._reload()
+        return self._snapshot
+
+    @property
+    def ready(self) -> bool:
+        return self.snapshot.version > 0 or self._file_id is not None
+
+    def current(self, timeout: float | None = None) -> Snapshot:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready and not self._stopping.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._stopping.wait(self.check_interval)
+        return self._snapshot
+
+    @property
+    def stopping(self) -> bool:
+        return self._stopping.is_set()
+
+    def wait_for_change(self, version: int, timeout: float | None = None) -> Snapshot:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.snapshot.version == version and not self._stopping.is_set():
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            self._stopping.wait(self.check_interval)
+        return self._snapshot
+
+    def feed_status(self, url: str) -> FeedStatus:
+        self._reload()
+        return self._statuses.get(url) or FeedStatus(url, None, 0, None, "closed")
+
+    def start(self) -> None:
+        self._stopping.clear()
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stopping.set()
+
+    def _reload(self) -> None:
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            self._checked = now
+            try:
+                with open(self.path, "rb") as handle:
+                    info = os.fstat(handle.fileno())
+                    file_id = (info.st_ino, info.st_mtime_ns)
+                    if file_id == self._file_id:
+                        return
+                    with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        snapshot, statuses = decode_snapshot(mapped)
+            except (OSError, ValueError, EOFError) as exc:
+                if self._file_id is not None:
+                    log.warning("snapshot read from %s failed: %s", self.path, exc)
+                return
+            self._file_id = file_id
+            self._snapshot = snapshot
+            self._statuses = statuses
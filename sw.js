@@ -26,6 +26,10 @@ self.addEventListener("fetch", (event) => {
   if (request.method !== "GET") {
     return;
   }
+  // Live update streams never end; let the browser handle them directly.
+  if (new URL(request.url).pathname.endsWith("/events")) {
+    return;
+  }
   event.respondWith(
     fetch(request)
       .then((response) => {
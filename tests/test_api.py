@@ -0,0 +1,47 @@
+import datetime as dt
+import struct
+
+from api import BINARY_FORMAT, BINARY_MAGIC, encode_binary
+from timetable_svg import ET_TZ, ScheduleRow
+
+
+def decode_binary(data):
+    assert data[:4] == BINARY_MAGIC
+    fmt, now, count = struct.unpack_from("<BIH", data, 4)
+    pos = 11
+    strings = []
+    for _ in range(count):
+        length = data[pos]
+        strings.append(data[pos + 1:pos + 1 + length].decode("utf-8"))
+        pos += 1 + length
+    (row_count,) = struct.unpack_from("<H", data, pos)
+    pos += 2
+    rows = []
+    for _ in range(row_count):
+        route, stop, direction, n = struct.unpack_from("<HHBB", data, pos)
+        pos += 6
+        times = struct.unpack_from(f"<{n}I", data, pos)
+        pos += 4 * n
+        rows.append((strings[route], strings[stop], direction, times))
+    assert pos == len(data)
+    return fmt, now, rows
+
+
+def test_binary_round_trip_with_more_than_255_strings():
+    now = dt.datetime.fromtimestamp(1_800_000_000, ET_TZ)
+    rows = [
+        ScheduleRow("7", f"Station {i}", "Uptown" if i % 2 else "Downtown", (1_800_000_060 + i,))
+        for i in range(300)
+    ]
+    fmt, stamp, decoded = decode_binary(encode_binary(rows, now))
+    assert fmt == BINARY_FORMAT
+    assert stamp == 1_800_000_000
+    assert decoded == [
+        (row.route, row.stop_name, 0 if row.direction == "Uptown" else 1, row.times) for row in rows
+    ]
+
+
+def test_long_names_are_cut_on_a_character_boundary():
+    name = "a" * 254 + "é"
+    _, _, decoded = decode_binary(encode_binary([ScheduleRow("7", name, "Uptown", ())], dt.datetime.now(ET_TZ)))
+    assert decoded[0][1] == "a" * 254
@@ -0,0 +1,50 @@
+import csv
+import io
+import sys
+
+import history
+from extract import Arrival
+
+START = 1_800_000_000
+
+
+def record(directory):
+    recorder = history.HistoryRecorder(str(directory), segment_seconds=60, chunk_rows=2)
+    recorder.record([
+        Arrival("7", "718", "N", START + 300, "trip-1"),
+        Arrival("7", "718", "S", START + 360, "trip-2"),
+        Arrival("G", "G21", "N", START + 420, "trip-3"),
+    ], START)
+    recorder.record([Arrival("7", "718", "N", START + 290, "trip-1")], START + 90)
+    recorder.close()
+
+
+def export(monkeypatch, capsys, directory, *args):
+    argv = ["history.py", "--dir", str(directory), "--start", str(START), "--end", str(START + 3600), *args]
+    monkeypatch.setattr(sys, "argv", argv)
+    history.main()
+    return list(csv.DictReader(io.StringIO(capsys.readouterr().out)))
+
+
+def test_record_then_query(tmp_path):
+    record(tmp_path)
+    rows = list(history.query(str(tmp_path), START, START + 3600, segment_seconds=60))
+    assert [(row.observed_at, row.trip_id, row.stop_id, row.direction, row.predicted) for row in rows] == [
+        (START, "trip-1", "718", "N", START + 300),
+        (START, "trip-2", "718", "S", START + 360),
+        (START, "trip-3", "G21", "N", START + 420),
+        (START + 90, "trip-1", "718", "N", START + 290),
+    ]
+    assert list(history.query(str(tmp_path), START + 60, START + 3600, segment_seconds=60)) == rows[3:]
+
+
+def test_cli_stop_filter(tmp_path, monkeypatch, capsys):
+    record(tmp_path)
+    uptown = export(monkeypatch, capsys, tmp_path, "--stop", "718N")
+    assert [(row["trip_id"], row["predicted"]) for row in uptown] == [
+        ("trip-1", str(START + 300)),
+        ("trip-1", str(START + 290)),
+    ]
+    assert len(export(monkeypatch, capsys, tmp_path, "--stop", "718")) == 3
+    assert [row["trip_id"] for row in export(monkeypatch, capsys, tmp_path, "--route", "G")] == ["trip-3"]
+
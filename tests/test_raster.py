@@ -0,0 +1,49 @@
+import datetime as dt
+import struct
+
+import pytest
+
+import raster
+from timetable_svg import ET_TZ, ScheduleRow
+
+pytestmark = pytest.mark.skipif(not raster.available(), reason="Pillow is not installed")
+
+ROWS = [
+    ScheduleRow("7", "Vernon Blvd-Jackson Av", "Uptown", (1_800_000_300, 1_800_000_900)),
+    ScheduleRow("G", "21 St", "Downtown", (1_800_000_420,)),
+]
+
+
+def diff_rects(data):
+    assert data[:4] == raster.DIFF_MAGIC
+    bits, _, _, count = struct.unpack_from("<BHHH", data, 4)
+    pos, rects = 11, []
+    for _ in range(count):
+        x, y, w, h = struct.unpack_from("<HHHH", data, pos)
+        rects.append((x, y, w, h))
+        pos += 8 + w * bits // 8 * h
+    assert pos == len(data)
+    return rects
+
+
+@pytest.mark.parametrize("bits", raster.SUPPORTED_BITS)
+def test_diff_against_frame_rendered_by_another_process(tmp_path, bits):
+    first = dt.datetime.fromtimestamp(1_800_000_000, ET_TZ)
+    later = first + dt.timedelta(minutes=1)
+    writer = raster.RasterRenderer(frame_dir=str(tmp_path))
+    reader = raster.RasterRenderer(frame_dir=str(tmp_path))
+    base = writer.render("first", lambda: ROWS, first, bits)
+    frame = reader.render("later", lambda: ROWS, later, bits)
+
+    rects = diff_rects(reader.diff(base.frame_id, frame))
+    assert rects and (0, 0, raster.WIDTH, raster.HEIGHT) not in rects
+    assert diff_rects(raster.RasterRenderer().diff(base.frame_id, frame)) == [(0, 0, raster.WIDTH, raster.HEIGHT)]
+    assert diff_rects(reader.diff("../../etc/passwd", frame)) == [(0, 0, raster.WIDTH, raster.HEIGHT)]
+
+
+def test_shared_frames_are_pruned(tmp_path):
+    renderer = raster.RasterRenderer(max_frames=2, frame_dir=str(tmp_path))
+    start = dt.datetime.fromtimestamp(1_800_000_000, ET_TZ)
+    for minute in range(4):
+        renderer.render(minute, lambda: ROWS, start + dt.timedelta(minutes=minute), 1)
+    assert len(list(tmp_path.glob("*.frame"))) == 2
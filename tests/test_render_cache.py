@@ -0,0 +1,29 @@
+import pytest
+
+from render_cache import encode_payload
+
+BODY = b"<svg>" + b"<text>7 Queensboro Plaza</text>" * 64 + b"</svg>"
+
+
+@pytest.mark.parametrize(
+    "header, gzipped",
+    [
+        ("gzip", True),
+        ("*", True),
+        ("gzip;q=0, *", False),
+        ("*, gzip;q=0", False),
+        ("GZIP;q=0.5", True),
+        ("identity", False),
+        ("", False),
+        (None, False),
+    ],
+)
+def test_negotiate_honours_refused_codings(header, gzipped):
+    rendered = encode_payload(BODY)
+    rendered.encodings.pop("br", None)
+    assert (rendered.negotiate(header) == "gzip") is gzipped
+
+
+def test_negotiate_never_picks_a_refused_coding():
+    rendered = encode_payload(BODY)
+    assert rendered.negotiate("br;q=0, gzip;q=0, *") is None
@@ -0,0 +1,86 @@
+import datetime as dt
+import random
+
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from extract import StopIndex, iter_feed_arrivals
+from schedule_index import ScheduleIndex, schedule_rows
+from timetable_svg import ET_TZ, build_schedule
+
+# 718 and R09 share a name, so their rows are merged.
+STOP_MAP = {"718": "Queens Plaza", "R09": "Queens Plaza", "G21": "Court Sq", "A02": "Inwood"}
+STOP_IDS = list(STOP_MAP) + ["101", "102"]
+ROUTES = ["7", "N", "W", "E", "M"]
+SOURCES = ["gtfs", "gtfs-nqrw", "gtfs-ace"]
+
+
+def make_feed(trips):
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = "1.0"
+    for trip_id, (route, stops) in sorted(trips.items()):
+        entity = feed.entity.add(id=trip_id)
+        entity.trip_update.trip.trip_id = trip_id
+        entity.trip_update.trip.route_id = route
+        for stop_id, ts in stops:
+            stu = entity.trip_update.stop_time_update.add(stop_id=stop_id)
+            stu.arrival.time = ts
+    return feed
+
+
+def random_trip(rng, now):
+    stops = [
+        (rng.choice(STOP_IDS) + rng.choice("NS"), now + rng.randint(-300, 3600))
+        for _ in range(rng.randint(1, 4))
+    ]
+    return rng.choice(ROUTES), stops
+
+
+def mutate(rng, trips, now, source):
+    trips = dict(trips)
+    for trip_id in list(trips):
+        roll = rng.random()
+        if roll < 0.15:
+            del trips[trip_id]
+        elif roll < 0.4:
+            route, stops = trips[trip_id]
+            trips[trip_id] = (route, [(stop_id, ts + rng.randint(-120, 240)) for stop_id, ts in stops])
+    for _ in range(rng.randint(0, 5)):
+        trips[f"{source}-{rng.randrange(10**6)}"] = random_trip(rng, now)
+    return trips
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_view_matches_build_schedule(seed):
+    rng = random.Random(seed)
+    index = StopIndex(STOP_MAP)
+    schedule = ScheduleIndex()
+    now = 1_800_000_000
+    trips = {source: {} for source in SOURCES}
+    for _ in range(15):
+        now += rng.randint(0, 90)
+        source = rng.choice(SOURCES)
+        trips[source] = mutate(rng, trips[source], now, source)
+        feeds = {name: make_feed(source_trips) for name, source_trips in trips.items()}
+        schedule.apply(source, tuple(iter_feed_arrivals(feeds[source], index)), now=now)
+        view = schedule.view()
+
+        at = dt.datetime.fromtimestamp(now, ET_TZ)
+        for limit in (2, None):
+            expected = build_schedule(feeds.values(), index, at, limit=limit)
+            assert schedule_rows(view, STOP_MAP, at, limit=limit) == expected
+
+
+def test_view_is_immutable_and_reused_until_changed():
+    schedule = ScheduleIndex()
+    index = StopIndex(STOP_MAP)
+    feed = make_feed({"t1": ("7", [("718N", 1_800_000_600)])})
+    schedule.apply("gtfs", tuple(iter_feed_arrivals(feed, index)), now=1_800_000_000)
+    view = schedule.view()
+    assert schedule.view() is view
+    with pytest.raises(TypeError):
+        view["718"] = {}
+
+    schedule.apply("gtfs", (), now=1_800_000_000)
+    assert schedule.view() == {}
+    assert view["718"][("7", "N")] == (1_800_000_600,)
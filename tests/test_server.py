@@ -0,0 +1,83 @@
+import http.client
+import socket
+import threading
+
+import pytest
+
+import server
+from feeds import FeedStatus
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    monkeypatch.setattr(server, "STREAM_KEEPALIVE", 0.2)
+    monkeypatch.setattr(server, "STREAM_LIFETIME", 2.0)
+    started = []
+
+    def start(mode, workers=4, queue=4):
+        httpd = server.make_server("127.0.0.1", 0, mode=mode, workers=workers, queue=queue)
+        thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        thread.start()
+        started.append((httpd, thread))
+        return httpd.server_address[1]
+
+    yield start
+    for httpd, thread in started:
+        httpd.shutdown()
+        httpd.server_close()
+        thread.join(5)
+
+
+def get(port, path, timeout=5.0):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    conn.request("GET", path)
+    return conn, conn.getresponse()
+
+
+@pytest.mark.parametrize("mode", ["single", "threaded"])
+def test_requests_are_answered_while_a_stream_is_open(serve, mode):
+    port = serve(mode)
+    stream, response = get(port, "/events")
+    try:
+        if mode == "single":
+            assert response.status == 503
+        else:
+            assert response.status == 200
+            assert response.getheader("Content-Type").startswith("text/event-stream")
+        conn, other = get(port, "/metrics", timeout=1.0)
+        assert other.status == 200
+        other.read()
+        conn.close()
+    finally:
+        stream.close()
+
+
+def test_connections_beyond_the_queue_get_503(serve):
+    port = serve("threaded", workers=1, queue=1)
+    stream, response = get(port, "/events")
+    waiting = socket.create_connection(("127.0.0.1", port), timeout=5)
+    rejected = socket.create_connection(("127.0.0.1", port), timeout=5)
+    try:
+        assert response.status == 200
+        assert rejected.recv(1024).startswith(b"HTTP/1.1 503 ")
+    finally:
+        for conn in (rejected, waiting, stream):
+            conn.close()
+
+
+def test_feed_freshness_tells_missing_from_stale(monkeypatch):
+    statuses = {
+        "http://feeds.test/nyct%2Fgtfs-ace": FeedStatus("", 1_800_000_000 - 12, 0, None, "closed"),
+        "http://feeds.test/nyct%2Fgtfs-g": FeedStatus("", 1_800_000_000 - 340, 3, "timed out", "open"),
+        "http://feeds.test/nyct%2Fgtfs-l": FeedStatus("", None, 3, "timed out", "open"),
+    }
+
+    class Poller:
+        urls = list(statuses)
+
+        def feed_status(self, url):
+            return statuses[url]
+
+    monkeypatch.setattr(server, "poller", Poller())
+    monkeypatch.setattr(server.time, "time", lambda: 1_800_000_000.0)
+    assert server.feed_freshness() == "gtfs-ace=12, gtfs-g=340;stale;open, gtfs-l=missing;open"
@@ -0,0 +1,46 @@
+import time
+
+import pytest
+
+import snapshot_cache
+from extract import Arrival
+from feeds import FetchResult
+from poller import FeedPoller
+
+STOP_MAP = {"718": "Queensboro Plaza"}
+FRESH = "http://feeds.test/nyct%2Fgtfs-7"
+OLD = "http://feeds.test/nyct%2Fgtfs-g"
+
+
+def test_restore_skips_feeds_the_fetcher_would_drop(tmp_path):
+    now = time.time()
+    cache = snapshot_cache.SnapshotCache(str(tmp_path), max_age=3600)
+    for url, age in ((FRESH, 60), (OLD, 600)):
+        arrivals = (Arrival("7", "718", "N", int(now) + 300, f"trip-{age}"),)
+        cache.record(FetchResult(url, arrivals, f"digest-{age}", True, now - age, body=b"body"), STOP_MAP)
+    cache.save()
+
+    poller = FeedPoller(urls=[FRESH, OLD], stop_map=STOP_MAP, cache=snapshot_cache.SnapshotCache(str(tmp_path), max_age=3600))
+    poller.fetcher.max_stale = 300
+    assert poller.restore() == 1
+    assert set(poller.snapshot.feeds) == {FRESH}
+    assert poller.snapshot.feeds[FRESH].error == snapshot_cache.RESTORED
+
+
+def test_failed_save_keeps_bodies_staged(tmp_path, monkeypatch):
+    now = time.time()
+    arrivals = (Arrival("7", "718", "N", int(now) + 300, "trip-1"),)
+    cache = snapshot_cache.SnapshotCache(str(tmp_path))
+    cache.record(FetchResult(FRESH, arrivals, "digest-1", True, now, body=b"body-1"), STOP_MAP)
+    write_atomic = snapshot_cache._write_atomic
+
+    def disk_full(path, data):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(snapshot_cache, "_write_atomic", disk_full)
+    with pytest.raises(OSError):
+        cache.save()
+    monkeypatch.setattr(snapshot_cache, "_write_atomic", write_atomic)
+    cache.save()
+    assert cache.read_body(FRESH) == b"body-1"
+    assert cache.load(STOP_MAP)[FRESH].digest == "digest-1"
@@ -1,19 +1,46 @@
 #!/usr/bin/env python3
 
 import datetime as dt
+import os
 from collections import defaultdict
-from typing import Dict, Iterable, List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Tuple
 from zoneinfo import ZoneInfo
 
-import requests
 from google.transit import gtfs_realtime_pb2
 
-ACE_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-ace"
-NQRW_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-nqrw"
-BDFM_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs-bdfm"
-NUMBERTRAINS_URL = "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds/nyct%2Fgtfs"
+from extract import DIRECTIONS, Arrival, StopIndex, iter_feed_arrivals, stop_index_for
+from feeds import fetch_feed, fetch_feeds
+from gtfs_static import load_static_index, routes_for_stops
 
+# Point at a local stand-in (see feed_sim.py) with e.g.
+# MTA_FEED_BASE=http://127.0.0.1:8200/Dataservice/mtagtfsfeeds
+FEED_BASE = os.getenv("MTA_FEED_BASE", "https://api-endpoint.mta.info/Dataservice/mtagtfsfeeds").rstrip("/")
+
+ACE_URL = f"{FEED_BASE}/nyct%2Fgtfs-ace"
+NQRW_URL = f"{FEED_BASE}/nyct%2Fgtfs-nqrw"
+BDFM_URL = f"{FEED_BASE}/nyct%2Fgtfs-bdfm"
+NUMBERTRAINS_URL = f"{FEED_BASE}/nyct%2Fgtfs"
+G_URL = f"{FEED_BASE}/nyct%2Fgtfs-g"
+JZ_URL = f"{FEED_BASE}/nyct%2Fgtfs-jz"
+L_URL = f"{FEED_BASE}/nyct%2Fgtfs-l"
+SIR_URL = f"{FEED_BASE}/nyct%2Fgtfs-si"
+
+# Used when there is no static GTFS data to plan from.
 FEED_URLS = [ACE_URL, NQRW_URL, BDFM_URL, NUMBERTRAINS_URL]
+ALL_FEED_URLS = [ACE_URL, NQRW_URL, BDFM_URL, NUMBERTRAINS_URL, G_URL, JZ_URL, L_URL, SIR_URL]
+
+# Which realtime feed carries each route_id.
+ROUTE_FEEDS = {
+    **dict.fromkeys(["A", "C", "E", "H", "FS"], ACE_URL),
+    **dict.fromkeys(["N", "Q", "R", "W"], NQRW_URL),
+    **dict.fromkeys(["B", "D", "F", "FX", "M"], BDFM_URL),
+    **dict.fromkeys(["1", "2", "3", "4", "5", "5X", "6", "6X", "7", "7X", "GS"], NUMBERTRAINS_URL),
+    "G": G_URL,
+    **dict.fromkeys(["J", "Z"], JZ_URL),
+    "L": L_URL,
+    **dict.fromkeys(["SI", "SS"], SIR_URL),
+}
 ET_TZ = ZoneInfo("America/New_York")
 
 # Stop IDs without direction suffix.
@@ -50,146 +77,165 @@ ROUTE_COLORS = {
 }
 
 
-def fetch_feed(url: str) -> gtfs_realtime_pb2.FeedMessage:
-    resp = requests.get(url, timeout=10)
-    resp.raise_for_status()
-    feed = gtfs_realtime_pb2.FeedMessage()
-    feed.ParseFromString(resp.content)
-    return feed
+# Wall display geometry, shared with the raster renderer.
+SVG_WIDTH = 1872
+SVG_HEIGHT = 1404
+SVG_MARGIN = 88
+SVG_HEADER_H = 132
+SVG_TABLE_Y = SVG_MARGIN + SVG_HEADER_H
+SVG_TABLE_H = SVG_HEIGHT - SVG_MARGIN - SVG_TABLE_Y
+SVG_COL_LINE = SVG_MARGIN + 150
+SVG_COL_STOP = SVG_COL_LINE + 460
+SVG_COL_DIR = SVG_COL_STOP + 470
+SVG_COL_NEXT = SVG_COL_DIR + 300
+
+SVG_BG = "#FAFAF7"
+SVG_FG = "#151515"
+SVG_HEADER = "#111111"
+SVG_MUTED = "#6F6F6F"
+SVG_FONT = "'Avenir Next', Avenir, 'Helvetica Neue', Helvetica, Arial, sans-serif"
+
+# Static markup is built once; render_svg() only fills in the clock and rows.
+SVG_HEAD = (
+    f'<svg xmlns="http://www.w3.org/2000/svg" width="100%" height="100%" viewBox="0 0 {SVG_WIDTH} {SVG_HEIGHT}" preserveAspectRatio="xMidYMid meet">\n'
+    "<style>"
+    f"text{{font-family:{SVG_FONT}}}"
+    f".h{{fill:{SVG_HEADER};font-size:58px;font-weight:600;letter-spacing:1px}}"
+    f".a{{fill:{SVG_MUTED};font-size:20px;text-anchor:end}}"
+    ".b{fill:#FFFFFF;font-size:30px;font-weight:700;text-anchor:middle}"
+    f".s{{fill:{SVG_FG};font-size:28px}}"
+    f".d{{fill:{SVG_MUTED};font-size:20px}}"
+    f".t{{fill:{SVG_FG};font-size:30px;font-weight:600}}"
+    "</style>\n"
+    f'<rect width="{SVG_WIDTH}" height="{SVG_HEIGHT}" fill="{SVG_BG}"/>\n'
+    f'<text class="h" x="{SVG_MARGIN}" y="{SVG_MARGIN + 42}">MTA ARRIVALS</text>\n'
+    f'<text class="a" x="{SVG_WIDTH - SVG_MARGIN}" y="{SVG_MARGIN + 42}">As of '
+).encode("utf-8")
+SVG_HEAD_END = b" ET</text>\n"
+
+
+def route_color(route: str) -> str:
+    index = load_static_index()
+    color = index.route_color(route) if index is not None else None
+    return color or ROUTE_COLORS.get(route, "#222222")
+
+
+def resolve_stops(stop_ids: Iterable[str]) -> Dict[str, str]:
+    """Build a stop map for ``stop_ids`` using names from the static index."""
+    index = load_static_index()
+    stop_map = {}
+    for stop_id in stop_ids:
+        name = index.stop_name(stop_id) if index is not None else None
+        stop_map[stop_id] = name or MY_STOPS.get(stop_id, stop_id)
+    return stop_map
+
+
+class ScheduleRow(NamedTuple):
+    route: str
+    stop_name: str
+    direction: str
+    # Epoch seconds, soonest first; converted to local time only when rendered.
+    times: Tuple[int, ...]
 
 
 def iter_arrivals(
     feed: gtfs_realtime_pb2.FeedMessage,
-    stop_map: Dict[str, str],
-) -> Iterable[Dict[str, object]]:
-    for ent in feed.entity:
-        if not ent.HasField("trip_update"):
-            continue
-        tu = ent.trip_update
-        route = tu.trip.route_id
-        for stu in tu.stop_time_update:
-            stop_id = stu.stop_id
-            if not stop_id:
-                continue
-            stop_key = stop_id[:-1]
-            if stop_key not in stop_map:
-                continue
-            arr = stu.arrival.time if stu.HasField("arrival") else None
-            dep = stu.departure.time if stu.HasField("departure") else None
-            ts = arr or dep
-            if not ts:
-                continue
-            direction_flag = stop_id[-1]
-            direction = "Uptown" if direction_flag == "N" else "Downtown"
-            yield {
-                "route": route,
-                "stop_name": stop_map[stop_key],
-                "direction": direction,
-                "arrival_time": dt.datetime.fromtimestamp(ts, ET_TZ),
-            }
+    stop_map: Dict[str, str] | StopIndex,
+) -> Iterable[Arrival]:
+    return iter_feed_arrivals(feed, stop_index_for(stop_map))
 
 
-def build_schedule(
-    feeds: Iterable[gtfs_realtime_pb2.FeedMessage],
+def group_arrivals(
+    arrivals: Iterable[Arrival],
     stop_map: Dict[str, str],
     now: dt.datetime,
     limit: int | None = 2,
-) -> List[Dict[str, object]]:
-    grouped: Dict[Tuple[str, str, str], List[dt.datetime]] = defaultdict(list)
-    for feed in feeds:
-        for arrival in iter_arrivals(feed, stop_map):
-            arr_time = arrival["arrival_time"]
-            if not isinstance(arr_time, dt.datetime) or arr_time <= now:
-                continue
-            key = (arrival["route"], arrival["stop_name"], arrival["direction"])
-            grouped[key].append(arr_time)
+) -> List[ScheduleRow]:
+    # Stops sharing a name (e.g. 718 and R09) are grouped into one row.
+    cutoff = now.timestamp()
+    grouped: Dict[Tuple[str, str, str], List[int]] = defaultdict(list)
+    for arrival in arrivals:
+        if arrival.time <= cutoff:
+            continue
+        key = (arrival.route, stop_map[arrival.stop_id], arrival.direction)
+        grouped[key].append(arrival.time)
 
     rows = []
     for (route, stop_name, direction), times in grouped.items():
         times.sort()
         next_times = times if limit is None else times[:limit]
-        rows.append(
-            {
-                "route": route,
-                "stop_name": stop_name,
-                "direction": direction,
-                "times": next_times,
-            }
-        )
-    rows.sort(key=lambda r: (r["stop_name"], r["route"], r["direction"]))
+        rows.append(ScheduleRow(route, stop_name, DIRECTIONS[direction], tuple(next_times)))
+    rows.sort(key=lambda r: (r.stop_name, r.route, r.direction))
     return rows
 
 
-def render_svg(rows: List[Dict[str, object]], now: dt.datetime) -> str:
-    width = 1872
-    height = 1404
-    margin = 88
-    header_h = 132
-    table_y = margin + header_h
-    table_h = height - margin - table_y
-    row_count = max(len(rows), 1)
-    row_h = min(78, int(table_h / row_count))
-    col_line = margin + 150
-    col_stop = col_line + 460
-    col_dir = col_stop + 470
-    col_next = col_dir + 300
-
-    def esc(text: str) -> str:
-        return (
-            text.replace("&", "&amp;")
-            .replace("<", "&lt;")
-            .replace(">", "&gt;")
-            .replace('"', "&quot;")
-        )
+def build_schedule(
+    feeds: Iterable[gtfs_realtime_pb2.FeedMessage],
+    stop_map: Dict[str, str] | StopIndex,
+    now: dt.datetime,
+    limit: int | None = 2,
+) -> List[ScheduleRow]:
+    index = stop_index_for(stop_map)
+    arrivals = (a for feed in feeds for a in iter_feed_arrivals(feed, index))
+    return group_arrivals(arrivals, index.stop_map, now, limit=limit)
+
+
+@lru_cache(maxsize=4096)
+def _clock(minute: int) -> str:
+    return dt.datetime.fromtimestamp(minute * 60, ET_TZ).strftime("%H:%M")
+
+
+def format_arrival(ts: int, now: dt.datetime) -> str:
+    minutes = max(0, int((ts - now.timestamp()) // 60))
+    return f"{_clock(int(ts) // 60)} · {minutes}m"
 
-    def fmt_time(t: dt.datetime) -> str:
-        minutes = max(0, int((t - now).total_seconds() // 60))
-        return f"{t.strftime('%H:%M')} · {minutes}m"
 
-    bg = "#FAFAF7"
-    fg = "#151515"
-    header = "#111111"
-    muted = "#6F6F6F"
-    font = "Avenir Next, Avenir, Helvetica Neue, Helvetica, Arial, sans-serif"
+def _esc(text: str) -> str:
+    return (
+        text.replace("&", "&amp;")
+        .replace("<", "&lt;")
+        .replace(">", "&gt;")
+        .replace('"', "&quot;")
+    )
 
-    lines = [
-        f'<svg xmlns="http://www.w3.org/2000/svg" width="100%" height="100%" viewBox="0 0 {width} {height}" preserveAspectRatio="xMidYMid meet">',
-        f'<rect width="{width}" height="{height}" fill="{bg}"/>',
-        f'<text x="{margin}" y="{margin + 42}" fill="{header}" font-family="{font}" font-size="58" font-weight="600" letter-spacing="1">MTA ARRIVALS</text>',
-        f'<text x="{width - margin}" y="{margin + 42}" fill="{muted}" font-family="{font}" font-size="20" text-anchor="end">As of {now.strftime("%a %b %d %H:%M")} ET</text>',
-    ]
 
+@lru_cache(maxsize=1024)
+def _svg_row_labels(route: str, stop_name: str, direction: str, middle: float) -> bytes:
+    # Badge, stop and direction only change with the row layout.
+    return (
+        f'<circle cx="{SVG_MARGIN + 30}" cy="{middle}" r="30" fill="{route_color(route)}"/>'
+        f'<text class="b" x="{SVG_MARGIN + 30}" y="{middle + 10}">{_esc(route)}</text>'
+        f'<text class="s" x="{SVG_COL_LINE}" y="{middle + 6}">{_esc(stop_name)}</text>'
+        f'<text class="d" x="{SVG_COL_STOP}" y="{middle + 6}">{_esc(direction)}</text>\n'
+    ).encode("utf-8")
+
+
+def render_svg(rows: List[ScheduleRow], now: dt.datetime) -> bytes:
+    row_h = min(78, int(SVG_TABLE_H / max(len(rows), 1)))
+    chunks = [SVG_HEAD, now.strftime("%a %b %d %H:%M").encode(), SVG_HEAD_END]
     for i, row in enumerate(rows):
-        y = table_y + (i + 1) * row_h
-        route = str(row["route"])
-        stop_name = str(row["stop_name"])
-        direction = str(row["direction"])
-        times = row["times"]
-        t1 = fmt_time(times[0]) if len(times) > 0 else "--:--"
-        t2 = fmt_time(times[1]) if len(times) > 1 else "--:--"
-        badge_color = ROUTE_COLORS.get(route, "#222222")
-
-        lines.append(
-            f'<circle cx="{margin + 30}" cy="{y - row_h / 2}" r="30" fill="{badge_color}"/>'
-        )
-        lines.append(
-            f'<text x="{margin + 30}" y="{y - row_h / 2 + 10}" fill="#FFFFFF" font-family="{font}" font-size="30" font-weight="700" text-anchor="middle">{esc(route)}</text>'
-        )
-        lines.append(
-            f'<text x="{col_line}" y="{y - row_h / 2 + 6}" fill="{fg}" font-family="{font}" font-size="28">{esc(stop_name)}</text>'
-        )
-        lines.append(
-            f'<text x="{col_stop}" y="{y - row_h / 2 + 6}" fill="{muted}" font-family="{font}" font-size="20">{esc(direction)}</text>'
-        )
-        lines.append(
-            f'<text x="{col_dir}" y="{y - row_h / 2 + 6}" fill="{fg}" font-family="{font}" font-size="30" font-weight="600">{t1}</text>'
-        )
-        lines.append(
-            f'<text x="{col_next}" y="{y - row_h / 2 + 6}" fill="{fg}" font-family="{font}" font-size="30" font-weight="600">{t2}</text>'
+        middle = SVG_TABLE_Y + (i + 1) * row_h - row_h / 2
+        times = row.times
+        t1 = format_arrival(times[0], now) if len(times) > 0 else "--:--"
+        t2 = format_arrival(times[1], now) if len(times) > 1 else "--:--"
+        chunks.append(_svg_row_labels(row.route, row.stop_name, row.direction, middle))
+        chunks.append(
+            f'<text class="t" x="{SVG_COL_DIR}" y="{middle + 6}">{t1}</text>'
+            f'<text class="t" x="{SVG_COL_NEXT}" y="{middle + 6}">{t2}</text>\n'.encode("utf-8")
         )
+    chunks.append(b"</svg>")
+    return b"".join(chunks)
+
 
-    lines.append("</svg>")
-    return "\n".join(lines)
+def plan_feed_urls(stop_map: Dict[str, str] | None = None) -> List[str]:
+    """Feeds that can produce arrivals for ``stop_map``, per the static GTFS."""
+    routes = routes_for_stops((stop_map or MY_STOPS).keys())
+    if not routes:
+        return list(FEED_URLS)
+    if any(route not in ROUTE_FEEDS for route in routes):
+        return list(ALL_FEED_URLS)
+    planned = {ROUTE_FEEDS[route] for route in routes}
+    return [url for url in ALL_FEED_URLS if url in planned]
 
 
 def generate_svg(
@@ -205,10 +251,10 @@ def generate_svg(
 def get_schedule(
     stop_map: Dict[str, str] | None = None,
     limit: int | None = None,
-) -> Tuple[List[Dict[str, object]], dt.datetime]:
+) -> Tuple[List[ScheduleRow], dt.datetime]:
     stop_map = stop_map or MY_STOPS
     now = dt.datetime.now(ET_TZ)
-    feeds = [fetch_feed(url) for url in FEED_URLS]
+    feeds = fetch_feeds(plan_feed_urls(stop_map)).values()
     rows = build_schedule(feeds, stop_map, now, limit=limit)
     return rows, now
 
@@ -217,7 +263,7 @@ def generate_svg_string(
     stop_map: Dict[str, str] | None = None,
 ) -> str:
     rows, now = get_schedule(stop_map=stop_map, limit=2)
-    return render_svg(rows, now)
+    return render_svg(rows, now).decode("utf-8")
 
 
 if __name__ == "__main__":